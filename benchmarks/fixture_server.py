@@ -0,0 +1,73 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# URLのパスの先頭と返す保存済みHTML（タレントID・月・予約番号にかかわらず同じページを返す）
+ROUTES = {
+    '/talent/': 'talent.html',
+    '/theater/': 'theater.html',
+    '/mypage/reservation/': 'reservation.html',
+}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    保存済みのHTMLを返すハンドラ
+    """
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に送るため、Nagleアルゴリズムによる遅延を避ける
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        for prefix, name in ROUTES.items():
+            if path.startswith(prefix):
+                body = self.server.pages[name]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """
+    タレント・劇場・マイページの代わりに保存済みHTMLを返すローカルHTTPサーバー
+    port=0 なら空いているポートを使う
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.pages = {}
+        for name in ROUTES.values():
+            with open(os.path.join(FIXTURE_DIR, name), 'rb') as file:
+                self.httpd.pages[name] = file.read()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    # 手動確認用: python -m benchmarks.fixture_server
+    with FixtureServer(port=int(os.getenv('BENCHMARK_FIXTURE_PORT', 8000))) as server:
+        print(f"保存済みHTMLを配信しています: {server.url}talent/1111, {server.url}theater/")
+        threading.Event().wait()
@@ -0,0 +1,162 @@
+import os
+import csv
+import json
+import random
+import argparse
+import datetime
+import pandas as pd
+from columnar import TALENT_SCHEMA, THEATER_SCHEMA, write_events_arrow
+import merge_events
+
+# 現在の運用規模（scale=1）。scale倍したタレント数・劇場数で生成する
+BASE_TALENTS = 20
+BASE_TALENT_EVENTS = 10  # タレント1人あたりのフィード項目数
+BASE_THEATERS = 8
+BASE_THEATER_EVENTS = 150  # 劇場1つあたりの公演数（3か月分）
+
+# 前回の結合結果（schedules/*.csv）から外す行・出演者を変える行の割合
+DROPPED_RATIO = 0.05
+CHANGED_RATIO = 0.05
+
+TITLES = ['よしもとライブ', '漫才ライブ「夜の部」', 'コントライブ２０２６', 'ネタバトル', 'トークライブ〜秋〜', '若手ネタライブ']
+TITLE_SUFFIXES = ['', '', '', ' 19:00の部', ' その弐', ' 11月公演']
+START_TIMES = ['11:00', '14:00', '17:00', '19:00', '21:00']
+
+
+def talent_list(scale):
+    return [{'id': str(100000 + i), 'name': f"タレント{i:06d}"} for i in range(BASE_TALENTS * scale)]
+
+def theater_names(scale):
+    return [f"劇場{i:05d}" for i in range(BASE_THEATERS * scale)]
+
+def shift_time(time_text, minutes):
+    hour, minute = map(int, time_text.split(':'))
+    total = hour * 60 + minute + minutes
+    return f"{total // 60:02d}:{total % 60:02d}"
+
+def generate_theater_events(rng, talents, venues, start):
+    """
+    劇場スケジュール（theater_schedules.csv の行）を生成
+    出演者には全劇場で均等になるようタレント名と無関係な芸人名を混ぜる
+    """
+    names = [talent['name'] for talent in talents]
+    rows = []
+    for v, venue in enumerate(venues):
+        for i in range(BASE_THEATER_EVENTS):
+            start_time = START_TIMES[i % len(START_TIMES)]
+            members = rng.sample(names, min(3, len(names))) + [f"芸人{rng.randrange(100000):05d}" for _ in range(2)]
+            rows.append({
+                'Venue': venue,
+                'Title': rng.choice(TITLES) + rng.choice(TITLE_SUFFIXES),
+                'Date': (start + datetime.timedelta(days=(i * 90) // BASE_THEATER_EVENTS)).isoformat(),
+                'OpenTime': shift_time(start_time, -30),
+                'StartTime': start_time,
+                'EndTime': shift_time(start_time, 120),
+                'Members': '／'.join(members),
+                'Detail': '配信あり。詳細は公式サイトをご確認ください。' if i % 3 else '-',
+                'Link': f"https://example.com/ticket/{v}/{i}"
+            })
+    return rows
+
+def generate_talent_events(rng, talents, theater_rows):
+    """
+    タレントのフィード項目（talent_tickets.csv の行）を生成
+    半数は劇場スケジュールと同じ公演（結合時に重複マージされる）、残りは劇場外の公演
+    同じ公演は実際のフィードと同様に、どのタレントのフィードでも出演者・画像・リンクが同じ値になる
+    """
+    by_member = {}
+    for row in theater_rows:
+        for member in row['Members'].split('／'):
+            by_member.setdefault(member, []).append(row)
+
+    # 劇場の公演ごとのフィード上の値（出演者・画像・リンク）
+    feed_values = {}
+
+    rows = []
+    for talent in talents:
+        appearances = by_member.get(talent['name'], [])
+        for i in range(BASE_TALENT_EVENTS):
+            if appearances and i % 2 == 0:
+                source = rng.choice(appearances)
+                title, date, start_time, venue = source['Title'], source['Date'], source['StartTime'], source['Venue']
+                if source['Link'] not in feed_values:
+                    feed_values[source['Link']] = (
+                        source['Members'].replace('／', ' '),
+                        f"https://example.com/img/flier/{rng.randrange(10000, 99999)}.jpg",
+                        source['Link']
+                    )
+                members, image, link = feed_values[source['Link']]
+            else:
+                title = rng.choice(TITLES)
+                date = (datetime.date(2026, 11, 1) + datetime.timedelta(days=rng.randrange(90))).isoformat()
+                start_time, venue = rng.choice(START_TIMES), f"ホール{rng.randrange(500):03d}"
+                members = f"{talent['name']} 芸人{rng.randrange(100000):05d}"
+                image = f"https://example.com/img/flier/{rng.randrange(10000, 99999)}.jpg"
+                link = f"https://example.com/ticket/{talent['id']}/{i}"
+            rows.append({
+                'TalentName': talent['name'],
+                'TalentID': talent['id'],
+                'Title': title,
+                'Date': date,
+                'StartTime': start_time,
+                'Members': members,
+                'Venue': venue,
+                'Image': image,
+                'Link': link
+            })
+    return rows
+
+def write_events(rows, path, schema):
+    """
+    スクレイピング結果と同じ形式のCSVと、結合処理が優先して読むArrowファイルを書き出す
+    """
+    pd.DataFrame(rows, columns=schema.names).to_csv(path, index=False, encoding='utf-8-sig', quoting=csv.QUOTE_ALL)
+    df = pd.read_csv(path, dtype=str, encoding='utf-8-sig')
+    write_events_arrow(df, os.path.splitext(path)[0] + '.arrow', schema, source=path)
+    return df
+
+def write_previous_schedules(rng, talent_df, theater_df, talents, output_dir):
+    """
+    前回の結合結果（schedules/*.csv）を書き出す
+    今回の結合結果から一部の行を除き、一部の行の出演者を変えて、新規・更新の差分が出るようにする
+    """
+    schedules_dir = os.path.join(output_dir, 'schedules')
+    os.makedirs(schedules_dir, exist_ok=True)
+    talent_schedules = merge_events.merge_schedules(talent_df, theater_df, talents)
+    for talent, merged_data in zip(talents, talent_schedules):
+        previous = merged_data[[rng.random() >= DROPPED_RATIO for _ in range(len(merged_data))]].copy()
+        changed = [rng.random() < CHANGED_RATIO for _ in range(len(previous))]
+        previous.loc[changed, '出演者'] = previous.loc[changed, '出演者'] + '／芸人99999'
+        previous.to_csv(os.path.join(schedules_dir, f"{talent['id']}_{talent['name']}.csv"),
+                        index=False, encoding='utf-8-sig', quoting=csv.QUOTE_ALL)
+
+def generate(output_dir, scale, seed=0):
+    """
+    scale倍の規模の talent_tickets.csv・theater_schedules.csv・schedules/*.csv を output_dir に生成
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    talents = talent_list(scale)
+    theater_rows = generate_theater_events(rng, talents, theater_names(scale), datetime.date(2026, 11, 1))
+    talent_rows = generate_talent_events(rng, talents, theater_rows)
+
+    theater_df = write_events(theater_rows, os.path.join(output_dir, 'theater_schedules.csv'), THEATER_SCHEMA)
+    talent_df = write_events(talent_rows, os.path.join(output_dir, 'talent_tickets.csv'), TALENT_SCHEMA)
+    with open(os.path.join(output_dir, 'talents.json'), 'w', encoding='utf-8') as file:
+        json.dump(talents, file, ensure_ascii=False)
+    write_previous_schedules(rng, talent_df, theater_df, talents, output_dir)
+
+    print(f"{output_dir}: タレント {len(talents)}人 / フィード {len(talent_rows)}件 / 劇場公演 {len(theater_rows)}件")
+    return talents
+
+def data_dir(scale):
+    return os.path.join(os.getenv('BENCHMARK_DATA_DIR', os.path.join('cache', 'benchmarks')), f"scale_{scale}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ベンチマーク用の合成データを生成')
+    parser.add_argument('--scale', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for scale in args.scale:
+        generate(data_dir(scale), scale, args.seed)
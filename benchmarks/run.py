@@ -0,0 +1,273 @@
+import os
+import io
+import json
+import time as t
+import logging
+import math
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+import pandas as pd
+from http_scraper import HttpClient
+from page_cache import PageCache
+from month_window import MonthWindow
+from columnar import load_events
+import talent_tickets
+import theater_schedules
+import mypage_tickets
+import merge_events
+from benchmarks.fixture_server import FixtureServer
+from benchmarks.generate_data import data_dir, generate
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# ベースラインより悪化したとみなす割合（スループットの低下・ピークメモリの増加）
+DEFAULT_TOLERANCE = 0.2
+# 1回の実行で全件を処理する結合の工程で、レイテンシの分位点を求めるための計測回数
+MERGE_SAMPLES = 10
+
+
+class Stage:
+    """
+    計測する工程
+    items の要素ごとに func を呼び出し、func は処理したレコード数を返す
+    min_samples はレイテンシの計測回数の下限（items が少ない工程は repeat より多く繰り返す）
+    """
+
+    def __init__(self, name, items, func, unit, min_samples=1):
+        self.name = name
+        self.items = items
+        self.func = func
+        self.unit = unit
+        self.min_samples = min_samples
+
+
+@contextmanager
+def working_directory(path):
+    """
+    結合処理は schedules/*.csv 等をカレントディレクトリから読むため、生成データのディレクトリで実行する
+    """
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+@contextmanager
+def environment(**values):
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+def http_stages(server, client, pages):
+    """
+    保存済みHTMLをローカルサーバーから取得・解析する工程
+    劇場は retrieve_monthly_schedules と同じ月の巡回をHTTPで行う fetch_schedule_info で計測する
+    """
+    talent_tickets.talent_url = f"{server.url}talent/"
+    no_cache = PageCache(enabled=False)
+
+    def talent_feed(i):
+        return len(talent_tickets.get_ticket_info(None, str(1000 + i), 'タレントA', client, no_cache))
+
+    def theater_schedule(i):
+        return len(theater_schedules.fetch_schedule_info(
+            client, 'XXX大ホール', f"{server.url}theater/", None, no_cache, MonthWindow(enabled=False)))
+
+    def mypage_details(i):
+        mypage_tickets.fetch_reservation_details(client, f"{server.url}mypage/reservation/{i}")
+        return 1
+
+    return [
+        Stage('get_ticket_info', range(pages), talent_feed, 'page'),
+        Stage('retrieve_monthly_schedules', range(pages), theater_schedule, 'venue'),
+        Stage('fetch_reservation_details', range(pages), mypage_details, 'page'),
+    ]
+
+def data_stages(path, talents):
+    """
+    生成データを使う結合・差分検出の工程
+    merge_events は merge_events.main 相当の全体、merge_schedules はそのうち結合のみ
+    """
+    def merge(_):
+        # merge_events.main と同じ読み込み・結合・保存（通知は除く）。ストアは毎回空から始める
+        with tempfile.TemporaryDirectory() as store_dir, working_directory(path), \
+                environment(EVENT_STORE_PATH=os.path.join(store_dir, 'events.db'), CSV_EXPORT='false'):
+            talent_df = load_events('talent_tickets.csv', 'talent_tickets.arrow')
+            theater_df = load_events('theater_schedules.csv', 'theater_schedules.arrow')
+            talent_schedules = merge_events.merge_schedules(talent_df, theater_df, talents)
+            merge_events.update_schedules(talents, talent_schedules)
+        return len(talent_df) + len(theater_df)
+
+    with working_directory(path):
+        talent_df = load_events('talent_tickets.csv', 'talent_tickets.arrow')
+        theater_df = load_events('theater_schedules.csv', 'theater_schedules.arrow')
+        talent_schedules = merge_events.merge_schedules(talent_df, theater_df, talents)
+        existing = [
+            pd.read_csv(f"schedules/{talent['id']}_{talent['name']}.csv", encoding='utf-8-sig')
+            for talent in talents
+        ]
+
+    def merge_only(_):
+        # 読み込み済みのデータの結合のみ（差分検出・保存を除く）
+        merge_events.merge_schedules(talent_df, theater_df, talents)
+        return len(talent_df) + len(theater_df)
+
+    def changes(i):
+        merge_events.detect_changes(talent_schedules[i], None, existing[i])
+        return len(talent_schedules[i])
+
+    return [
+        Stage('merge_events', range(1), merge, 'run', min_samples=MERGE_SAMPLES),
+        Stage('merge_schedules', range(1), merge_only, 'run', min_samples=MERGE_SAMPLES),
+        Stage('detect_changes', range(len(talents)), changes, 'talent'),
+    ]
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(ratio * (len(values) - 1))))]
+
+def measure(stage, repeat):
+    """
+    工程を repeat 回（レイテンシが min_samples 件に満たなければそれ以上）実行して
+    スループット・レイテンシを計測し、tracemalloc の影響を除くため、ピークメモリは別にもう1回実行して計測する
+    """
+    rounds = max(repeat, math.ceil(stage.min_samples / max(len(stage.items), 1)))
+    latencies = []
+    records = 0
+    with redirect_stdout(io.StringIO()):
+        started = t.perf_counter()
+        for _ in range(rounds):
+            for item in stage.items:
+                item_started = t.perf_counter()
+                records += stage.func(item)
+                latencies.append(t.perf_counter() - item_started)
+        elapsed = t.perf_counter() - started
+
+        tracemalloc.start()
+        try:
+            for item in stage.items:
+                stage.func(item)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'records_per_second': round(records / elapsed if elapsed else 0.0, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'latency_mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'peak_memory_mb': round(peak / 1024 / 1024, 3),
+        'samples': len(latencies),
+        'records': records // rounds,
+        'unit': stage.unit
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    ベースラインとの比を表示し、悪化した工程名の一覧を返す
+    判定はスループットとピークメモリで行う（レイテンシの分位点は計測回数が少ない工程では不安定なため表示のみ）
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"  {name}: ベースラインなし")
+            continue
+        speed = result['records_per_second'] / base['records_per_second'] if base['records_per_second'] else 1.0
+        memory = result['peak_memory_mb'] / base['peak_memory_mb'] if base['peak_memory_mb'] else 1.0
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"  {name}: スループット x{speed:.2f} / ピークメモリ x{memory:.2f}" + (" ← 悪化" if regressed else ""))
+    return regressions
+
+def print_results(scale, results):
+    print(f"\n[scale {scale}]")
+    print(f"  {'工程':<28}{'件/秒':>12}{'p50 ms':>10}{'p95 ms':>10}{'peak MB':>10}")
+    for name, result in results.items():
+        print(f"  {name:<28}{result['records_per_second']:>12.1f}{result['latency_p50_ms']:>10.2f}"
+              f"{result['latency_p95_ms']:>10.2f}{result['peak_memory_mb']:>10.2f}")
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_baseline(path, baseline):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, ensure_ascii=False, indent=2, sort_keys=True)
+        file.write('\n')
+
+def run(scales, repeat, pages, stages=None):
+    """
+    規模ごとに全工程を計測し、{規模: {工程名: 計測結果}} を返す
+    HTTPの工程は規模によらないため、最初の規模でのみ計測する
+    """
+    all_results = {}
+    with FixtureServer() as server, HttpClient() as client:
+        for number, scale in enumerate(scales):
+            path = data_dir(scale)
+            if not os.path.exists(os.path.join(path, 'talents.json')):
+                generate(path, scale)
+            with open(os.path.join(path, 'talents.json'), 'r', encoding='utf-8') as file:
+                talents = json.load(file)
+
+            selected = (http_stages(server, client, pages) if number == 0 else []) + data_stages(path, talents)
+            results = {}
+            for stage in selected:
+                if stages and stage.name not in stages:
+                    continue
+                results[stage.name] = measure(stage, repeat)
+            all_results[str(scale)] = results
+            print_results(scale, results)
+    return all_results
+
+def main():
+    parser = argparse.ArgumentParser(description='スクレイピング・結合処理のベンチマーク')
+    parser.add_argument('--scale', type=int, nargs='+', default=[10])
+    parser.add_argument('--repeat', type=int, default=3, help='各工程の実行回数')
+    parser.add_argument('--pages', type=int, default=20, help='HTTPの工程で取得するページ数')
+    parser.add_argument('--stage', nargs='+', help='計測する工程名（省略時は全工程）')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help='計測結果をベースラインとして保存')
+    args = parser.parse_args()
+
+    # タレントごとの処理ログは計測結果の表示を妨げるため抑止
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args.scale, args.repeat, args.pages, args.stage)
+    baseline = load_baseline(args.baseline)
+
+    if args.save_baseline:
+        for scale, scale_results in results.items():
+            baseline.setdefault(scale, {}).update(scale_results)
+        baseline['environment'] = {'python': platform.python_version(), 'machine': platform.machine()}
+        save_baseline(args.baseline, baseline)
+        print(f"\nベースラインを保存しました: {args.baseline}")
+        return
+
+    regressions = []
+    for scale, scale_results in results.items():
+        print(f"\n[scale {scale}] ベースラインとの比較（許容 {args.tolerance:.0%}）")
+        regressions.extend(f"{scale}:{name}" for name in compare(scale_results, baseline.get(scale, {}), args.tolerance))
+    if regressions:
+        print(f"\n悪化した工程: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+chromedriver_path = os.getenv('CHROMEDRIVER_PATH')
+
+# User-Agent（HTTPクライアントと共通）
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.6723.92 Safari/537.36"
+
+
+def setup_driver_options():
+    options = Options()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    # User-Agentの設定
+    options.add_argument(f"user-agent={USER_AGENT}")
+    return options
+
+def create_driver():
+    """
+    ヘッドレスChromeを起動
+    """
+    return webdriver.Chrome(service=Service(chromedriver_path), options=setup_driver_options())
+
+
+class BrowserSession:
+    """
+    1つのChromeを起動したまま使い回すセッション
+    クラッシュしたセッションは再起動して処理をやり直す
+    """
+
+    def __init__(self, max_restarts=1):
+        self.max_restarts = max_restarts
+        self.driver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.quit()
+
+    def start(self):
+        if self.driver is None:
+            self.driver = create_driver()
+        return self.driver
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+
+    def restart(self):
+        self.quit()
+        return self.start()
+
+    def is_alive(self):
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def visit(self, url, action=None):
+        """
+        URLへ遷移し、actionにdriverを渡して結果を返す
+        WebDriverの例外でセッションが落ちていれば再起動してやり直す
+        """
+        for attempt in range(self.max_restarts + 1):
+            driver = self.start()
+            try:
+                driver.get(url)
+                return action(driver) if action else None
+            except WebDriverException as e:
+                if self.is_alive() or attempt >= self.max_restarts:
+                    raise
+                print(f"ブラウザセッションが切断されたため再起動します: {e}")
+                self.restart()
+
+
+class BrowserPool:
+    """
+    複数のBrowserSessionを保持し、スレッド間で貸し出す
+    起動は初回の貸し出し時に行う
+    """
+
+    def __init__(self, size=None):
+        self.size = size or int(os.getenv('BROWSER_POOL_SIZE', 1))
+        self._idle = queue.LifoQueue()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def session(self):
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._sessions) < self.size:
+                session = BrowserSession()
+                self._sessions.append(session)
+                return session
+        return self._idle.get()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions:
+                session.quit()
+            self._sessions = []
@@ -1,46 +1,95 @@
 import pandas as pd
 import os
+from dotenv import load_dotenv
+from event_store import EventStore, ROLLUP_DIMENSIONS
+
+load_dotenv()
+
+TOTAL_COLUMNS = ["公演日ベース合計金額", "公演日ベース件数", "購入日ベース合計金額", "購入日ベース件数"]
 
 def extract_year_month(date_column):
     """Extract year and month from a date column with format 'YYYY年MM月DD日（曜日）'"""
     return date_column.str.extract(r"(\d{4}年\d{2}月)")[0]
 
-def calculate_monthly_totals(input_csv, output_csv):
-    """Calculate monthly totals and counts for 公演日 and 購入日 based on枚数 and save to a new CSV file."""
-    # Check if input file exists
+def load_purchase_history(input_csv, store=None):
+    """Load purchase history from the event store, falling back to the CSV file when the store is empty."""
+    if store is not None and store.count_purchases() > 0:
+        return store.load_purchases()
     if not os.path.exists(input_csv):
-        print(f"Input file '{input_csv}' does not exist.")
-        return
+        return None
+    return pd.read_csv(input_csv, encoding="utf-8-sig")
+
+def merge_monthly_totals(public_monthly_totals, purchase_monthly_totals, keys):
+    """Outer-merge the 公演日-based and 購入日-based totals on 年月 (and the dimension, if any)."""
+    monthly_totals = pd.merge(public_monthly_totals, purchase_monthly_totals, on=keys, how="outer")
+
+    # Only the total columns are filled with 0, so months that appear on one side keep their 年月
+    monthly_totals[TOTAL_COLUMNS] = monthly_totals[TOTAL_COLUMNS].fillna(0).astype(int)
+    return monthly_totals[keys + TOTAL_COLUMNS].sort_values(keys, ignore_index=True)
 
-    # Load the CSV file
-    df = pd.read_csv(input_csv, encoding="utf-8-sig")
+def scan_monthly_totals(df, dimension=None):
+    """Calculate monthly totals by scanning the whole purchase history."""
+    keys = ["年月"] + ([dimension] if dimension else [])
+    df = df.copy()
 
     # Extract year-month from 公演日 and 購入日
-    df["公演年月"] = extract_year_month(df["公演日"])
-    df["購入年月"] = extract_year_month(df["購入日"])
+    df["公演年月"] = extract_year_month(df["公演日"].astype(str))
+    df["購入年月"] = extract_year_month(df["購入日"].astype(str))
 
+    df["合計金額"] = pd.to_numeric(df["合計金額"], errors="coerce")
     df["枚数"] = pd.to_numeric(df["枚数"], errors="coerce")
+    if dimension:
+        df[dimension] = df[dimension].fillna("").astype(str)
 
     # Group by 公演年月 and 購入年月 and calculate totals and counts
-    public_monthly_totals = df.groupby("公演年月").agg(
+    public_monthly_totals = df.groupby(["公演年月"] + keys[1:]).agg(
         公演日ベース合計金額=("合計金額", "sum"), 公演日ベース件数=("枚数", "sum")
-    ).reset_index()
-    purchase_monthly_totals = df.groupby("購入年月").agg(
+    ).reset_index().rename(columns={"公演年月": "年月"})
+    purchase_monthly_totals = df.groupby(["購入年月"] + keys[1:]).agg(
         購入日ベース合計金額=("合計金額", "sum"), 購入日ベース件数=("枚数", "sum")
-    ).reset_index()
+    ).reset_index().rename(columns={"購入年月": "年月"})
 
-    # Merge both results on 年月
-    monthly_totals = pd.merge(public_monthly_totals, purchase_monthly_totals, left_on="公演年月", right_on="購入年月", how="outer").fillna(0)
+    return merge_monthly_totals(public_monthly_totals, purchase_monthly_totals, keys)
 
-    # Drop redundant column and rename
-    monthly_totals.drop(columns=["購入年月"], inplace=True)
-    monthly_totals.rename(columns={"公演年月": "年月"}, inplace=True)
+def rollup_monthly_totals(store, dimension=None):
+    """Read monthly totals from the incrementally maintained rollup in the event store."""
+    keys = ["年月"] + ([dimension] if dimension else [])
+    rollups = store.load_rollups(dimension or "").rename(columns={"値": dimension} if dimension else {})
 
-    # Convert totals to integers (no decimals)
-    monthly_totals["公演日ベース合計金額"] = monthly_totals["公演日ベース合計金額"].astype(int)
-    monthly_totals["購入日ベース合計金額"] = monthly_totals["購入日ベース合計金額"].astype(int)
-    monthly_totals["公演日ベース件数"] = monthly_totals["公演日ベース件数"].astype(int)
-    monthly_totals["購入日ベース件数"] = monthly_totals["購入日ベース件数"].astype(int)
+    totals = []
+    for basis in ["公演日", "購入日"]:
+        totals.append(rollups[rollups["基準"] == basis][keys + ["合計金額", "枚数"]].rename(columns={
+            "合計金額": f"{basis}ベース合計金額", "枚数": f"{basis}ベース件数"
+        }))
+    return merge_monthly_totals(totals[0], totals[1], keys)
+
+def verify_rollups(store, dimensions=None):
+    """Compare the rollup with a full scan of the purchase history and report any differences."""
+    purchases = store.load_purchases()
+    matched = True
+    for dimension in [None] + (dimensions or []):
+        expected = scan_monthly_totals(purchases, dimension)
+        actual = rollup_monthly_totals(store, dimension)
+        if not expected.equals(actual):
+            matched = False
+            print(f"Rollup mismatch ({dimension or '年月'}):")
+            print(expected.merge(actual, how="outer", indicator=True).query("_merge != 'both'"))
+    print("Rollup verification " + ("passed." if matched else "failed."))
+    return matched
+
+def calculate_monthly_totals(input_csv, output_csv, store=None, dimension=None):
+    """Calculate monthly totals and counts for 公演日 and 購入日 based on枚数 and save to a new CSV file."""
+    if store is not None and store.count_purchases() > 0:
+        # Apply reservations that have not been rolled up yet (e.g. stores created before the rollup existed)
+        store.update_rollups()
+        monthly_totals = rollup_monthly_totals(store, dimension)
+    else:
+        # Load the purchase history
+        df = load_purchase_history(input_csv)
+        if df is None:
+            print(f"Input file '{input_csv}' does not exist.")
+            return
+        monthly_totals = scan_monthly_totals(df, dimension)
 
     # Save the result to a new CSV file
     monthly_totals.to_csv(output_csv, index=False, encoding="utf-8-sig")
@@ -51,5 +100,15 @@ if __name__ == "__main__":
     input_csv = "purchase_history.csv"  # Replace with the correct path if necessary
     output_csv = "monthly_totals.csv"  # Output file name
 
+    # Additional dimensions, e.g. "会場名,席種,引取方法" (written to monthly_totals_<dimension>.csv)
+    dimensions = [d for d in os.getenv("MONTHLY_TOTALS_DIMENSIONS", "").split(",") if d in ROLLUP_DIMENSIONS]
+
     # Execute the calculation
-    calculate_monthly_totals(input_csv, output_csv)
+    with EventStore() as store:
+        if os.getenv("MONTHLY_TOTALS_REBUILD", "false").lower() == "true":
+            store.rebuild_rollups()
+        calculate_monthly_totals(input_csv, output_csv, store)
+        for dimension in dimensions:
+            calculate_monthly_totals(input_csv, f"monthly_totals_{dimension}.csv", store, dimension)
+        if os.getenv("MONTHLY_TOTALS_VERIFY", "false").lower() == "true":
+            verify_rollups(store, dimensions)
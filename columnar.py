@@ -0,0 +1,171 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# talent_tickets の列型
+TALENT_SCHEMA = pa.schema([
+    ('TalentName', CATEGORY),
+    ('TalentID', pa.string()),
+    ('Title', pa.string()),
+    ('Date', pa.date32()),
+    ('StartTime', pa.time32('s')),
+    ('Members', pa.string()),
+    ('Venue', CATEGORY),
+    ('Image', pa.string()),
+    ('Link', pa.string()),
+])
+
+# theater_schedules の列型
+THEATER_SCHEMA = pa.schema([
+    ('Venue', CATEGORY),
+    ('Title', pa.string()),
+    ('Date', pa.date32()),
+    ('OpenTime', pa.time32('s')),
+    ('StartTime', pa.time32('s')),
+    ('EndTime', pa.time32('s')),
+    ('Members', pa.string()),
+    ('Detail', pa.string()),
+    ('Link', pa.string()),
+])
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%H:%M'
+
+# 日付・時刻に変換できない表記（'-' 以外）を元の文字列のまま保持する列の接尾辞
+RAW_SUFFIX = 'Raw'
+# 書き出し元CSVのサイズと更新日時を保存するスキーマのメタデータキー
+SOURCE_KEY = b'source_signature'
+
+
+def write_events_arrow(df, path, schema, source=None):
+    """
+    スクレイピング結果を型付きのArrow IPCファイルに書き出す
+    日付・時刻は date32 / time32 に変換し、変換で表記が変わる値は元の文字列も保存する
+    source には同じ内容を書き出したCSVのパスを指定し、読み込み時にCSVが更新されていないかを確認する
+    """
+    df = blank_to_missing(df.reindex(columns=schema.names))
+    columns = {}
+    fields = []
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_date32(field.type):
+            typed, raw = _parse_column(values, DATE_FORMAT)
+            columns[field.name] = pa.array(typed.dt.date, type=field.type, from_pandas=True)
+        elif pa.types.is_time32(field.type):
+            typed, raw = _parse_column(values, TIME_FORMAT)
+            columns[field.name] = pa.array(typed.dt.time, type=field.type, from_pandas=True)
+        else:
+            columns[field.name] = pa.array(values.astype(object).where(values.notna(), None), type=field.type)
+            fields.append(field)
+            continue
+        fields.append(field)
+        raw_name = field.name + RAW_SUFFIX
+        columns[raw_name] = pa.array(raw, type=pa.string(), from_pandas=True)
+        fields.append(pa.field(raw_name, pa.string()))
+
+    metadata = {SOURCE_KEY: file_signature(source)} if source else None
+    table = pa.table(columns, schema=pa.schema(fields, metadata=metadata))
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def blank_to_missing(df):
+    """
+    CSVから読み込んだ場合と同様に、空文字を欠損値として扱う
+    """
+    return df.mask(df.astype(object) == '')
+
+def _parse_column(values, fmt):
+    """
+    文字列を日付・時刻に変換し、変換後の表記と一致しない値を元の文字列として返す
+    """
+    text = values.astype(object)
+    typed = pd.to_datetime(text, format=fmt, errors='coerce')
+    canonical = typed.dt.strftime(fmt)
+    raw = text.where(text.notna() & (text != '-') & (canonical != text), None)
+    return typed, raw
+
+def read_events_arrow(path):
+    """
+    Arrow IPCファイルをメモリマップで読み込む
+    日付は datetime64、時刻は timedelta64 の型付きの列（欠損は NaT）、Venue・TalentName はカテゴリ型になる
+    日付・時刻に変換できない表記は <列名>Raw 列に元の文字列のまま残す（該当する値がなければ列を省略）
+    CSVと同じ文字列表記が必要な場合は format_event_columns で変換する
+    """
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+        return _to_dataframe(table)
+
+def _to_dataframe(table):
+    df = pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+    for name in table.column_names:
+        column = table.column(name)
+        if name.endswith(RAW_SUFFIX) and name[:-len(RAW_SUFFIX)] in table.column_names:
+            if column.null_count < len(column):
+                df[name] = column.to_pandas()
+        elif pa.types.is_date32(column.type):
+            df[name] = column.to_pandas(date_as_object=False)
+        elif pa.types.is_time32(column.type):
+            df[name] = pd.to_timedelta(column.cast(pa.int32()).to_pandas(), unit='s')
+        else:
+            df[name] = column.to_pandas()
+    return df
+
+def format_event_columns(df):
+    """
+    型付きの日付・時刻の列をCSVと同じ文字列表記に戻す（文字列の列はそのまま）
+    表記は重複を除いた値についてだけ作成し、欠損は '-'、変換できなかった表記は元の文字列にする
+    """
+    converted = {}
+    for name in df.columns:
+        values = df[name]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            labels = _format_dates
+        elif pd.api.types.is_timedelta64_dtype(values):
+            labels = _format_times
+        else:
+            continue
+        codes, uniques = pd.factorize(values)
+        # 欠損値のコード -1 は末尾の '-' を参照する
+        text = pd.Series(np.append(labels(uniques), '-').astype(object)[codes], index=df.index)
+        raw_name = name + RAW_SUFFIX
+        if raw_name in df.columns:
+            text = df[raw_name].where(df[raw_name].notna(), text)
+        converted[name] = text
+    if not converted:
+        return df
+    raw_columns = [name + RAW_SUFFIX for name in converted if name + RAW_SUFFIX in df.columns]
+    return df.assign(**converted).drop(columns=raw_columns)
+
+def _format_dates(uniques):
+    return np.asarray(uniques.strftime(DATE_FORMAT), dtype=object)
+
+def _format_times(uniques):
+    seconds = uniques.total_seconds().astype(int)
+    return np.array([f"{value // 3600:02d}:{value % 3600 // 60:02d}" for value in seconds], dtype=object)
+
+def file_signature(path):
+    """
+    ファイルのサイズと更新日時（内容を読まずに更新の有無を判定する）
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_events(csv_path, arrow_path):
+    """
+    ArrowファイルがCSVの書き出し後に作成されていればメモリマップで、そうでなければCSVから読み込む
+    （JS版のスクレイパーがCSVだけを更新した場合はCSVを使う）
+    Arrowファイルから読み込んだ場合、日付・時刻は型付きの列になる（read_events_arrow を参照）
+    """
+    if os.path.exists(arrow_path):
+        with pa.memory_map(arrow_path, 'r') as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+        if not os.path.exists(csv_path) or metadata.get(SOURCE_KEY) == file_signature(csv_path).encode():
+            return read_events_arrow(arrow_path)
+    return pd.read_csv(csv_path)
@@ -1,61 +1,414 @@
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 import os
+import json
 import time
-import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
-import os
+from browser_session import USER_AGENT
 
 load_dotenv()
 
 # ベースURLの指定
 base_url = os.getenv('FLIER_BASE_URL')
-# ダウンロードする範囲を指定
-start_number = int(os.getenv('START_NUMBER'))
-end_number = int(os.getenv('END_NUMBER'))
 
 # 保存先のディレクトリを指定
 save_directory = "./flier_images/"
+# 画像ごとの取得状況を記録するファイル
+manifest_path = os.path.join(save_directory, "manifest.json")
+
+# 同時にダウンロードするスレッド数
+workers = int(os.getenv('FLIER_WORKERS', 4))
+# 同一ホストへの1秒あたりのリクエスト数の上限
+rate_per_second = float(os.getenv('FLIER_RATE_PER_SECOND', 1))
+
+# 取得済みの最大番号から新しい番号の上限を自動で探すか
+discover = os.getenv('FLIER_DISCOVER', 'false').lower() == 'true'
+# 欠番があっても探索を続ける連続した番号の幅
+discovery_window = int(os.getenv('FLIER_DISCOVERY_WINDOW', 3))
+# 指数探索で広げる間隔の上限（誤判定で探索が際限なく続かないようにする）
+discovery_max_step = int(os.getenv('FLIER_DISCOVERY_MAX_STEP', 1024))
+
+# 取得済みの画像を条件付きリクエストで再検証するか
+revalidate = os.getenv('FLIER_REVALIDATE', 'false').lower() == 'true'
+
+# 取得状況（missing・forbidden は次回以降もリクエストしない）
+STATUS_COMPLETE = 'complete'
+STATUS_MISSING = 'missing'
+STATUS_FORBIDDEN = 'forbidden'
+STATUS_FAILED = 'failed'
+
+
+class HostRateLimiter:
+    """
+    ホストごとのトークンバケット
+    429（または Retry-After 付きの403）を受けたらレートを半分にして待機し、成功が続けば元のレートまで少しずつ戻す
+    """
+
+    def __init__(self, rate, burst=1, min_rate=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ取得できるまで待機
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def throttle(self, retry_after=None):
+        """
+        レートを半分にし、Retry-After（なければ現在の間隔）だけ全スレッドを停止
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
 
-# 保存用ディレクトリを作成
-if not os.path.exists(save_directory):
-    os.makedirs(save_directory)
+class FlierManifest:
+    """
+    画像ごとの取得状況・サイズ・ハッシュ値・ETag・Last-Modified を保持するファイル
+    """
 
-def download_image(image_url, save_path, retries=3):
-    """画像をダウンロードする関数（エラー時のリトライ付き）"""
-    for attempt in range(retries):
+    def __init__(self, path, save_every=20):
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._changes = 0
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
         try:
-            response = requests.get(image_url, stream=True, timeout=10)
-            
-            # ステータスコードが403の場合の処理
-            if response.status_code == 403:
-                print(f"403 Forbidden: Skipping {image_url}")
-                return False
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"マニフェストを読み込めないため作り直します: {e}")
+            return {}
+
+    def get(self, image_name):
+        with self._lock:
+            return self.entries.get(image_name)
+
+    def update(self, image_name, entry):
+        """
+        取得結果を記録し、一定件数ごとにファイルへ書き出す
+        """
+        with self._lock:
+            self.entries[image_name] = dict(entry, checked_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+            self._changes += 1
+            if self._changes >= self.save_every:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # 書き込み途中で中断しても壊れないよう一時ファイルから置き換える
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._changes = 0
+
+
+def file_entry(save_path):
+    """
+    保存済みファイルのサイズとハッシュ値
+    """
+    digest = hashlib.sha256()
+    with open(save_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return {'status': STATUS_COMPLETE, 'size': os.path.getsize(save_path), 'sha256': digest.hexdigest()}
+
+def is_complete(entry, save_path):
+    """
+    マニフェスト上で取得済みかつ、同じサイズのファイルが存在するか
+    """
+    return (entry is not None and entry.get('status') == STATUS_COMPLETE
+            and os.path.exists(save_path) and os.path.getsize(save_path) == entry.get('size'))
+
+def conditional_headers(entry):
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def parse_retry_after(value):
+    """
+    Retry-After ヘッダーの秒数（秒数・日時のどちらの形式にも対応）
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
-            response.raise_for_status()  # HTTPエラーがあれば例外を発生
-            
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
+def create_session(pool_size):
+    """
+    Keep-Aliveで接続を使い回すセッション
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
 
+def download_image(session, limiter, image_url, save_path, entry=None, retries=3):
+    """
+    画像をダウンロードし、マニフェストに記録する内容を返す（エラー時のリトライ付き）
+    entry を指定した場合は条件付きリクエストで再検証し、更新がなければそのまま返す
+    """
+    headers = conditional_headers(entry) if entry else {}
+    attempt = 0
+    while attempt < retries:
+        limiter.acquire()
+        try:
+            with session.get(image_url, stream=True, timeout=10, headers=headers) as response:
+                # 429 と Retry-After 付きの403はレート制限とみなし、レートを下げて待機後に再試行
+                # （待機はリミッターが行い、試行回数に数える。使い切った場合は次回以降に再取得する）
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code == 429 or (response.status_code == 403 and retry_after is not None):
+                    limiter.throttle(retry_after)
+                    attempt += 1
+                    print(f"{response.status_code}: Backing off {image_url} (attempt {attempt}/{retries})")
+                    continue
+
+                # Retry-After のない403は画像ごとの拒否として記録し、次回以降もリクエストしない
+                if response.status_code == 403:
+                    print(f"403 Forbidden: Skipping {image_url}")
+                    return {'status': STATUS_FORBIDDEN}
+
+                if response.status_code == 404:
+                    limiter.success()
+                    return {'status': STATUS_MISSING}
+
+                if response.status_code == 304:
+                    limiter.success()
+                    return entry
+
+                response.raise_for_status()  # HTTPエラーがあれば例外を発生
+
+                # 途中で中断しても壊れたファイルが残らないよう一時ファイルから置き換える
+                tmp_path = f"{save_path}.part"
+                digest = hashlib.sha256()
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(65536):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, save_path)
+
+            limiter.success()
             print(f"Downloaded: {save_path}")
-            return True  # 成功した場合はTrueを返す
+            return {
+                'status': STATUS_COMPLETE,
+                'size': size,
+                'sha256': digest.hexdigest(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
         except requests.exceptions.RequestException as e:
             print(f"Error downloading {image_url} (attempt {attempt + 1}/{retries}): {e}")
+            attempt += 1
             time.sleep(2 ** attempt)  # リトライ前に指数関数的に遅延
-    return False  # すべてのリトライが失敗した場合
+    return {'status': STATUS_FAILED}  # すべてのリトライが失敗した場合
 
-# 画像を順番にダウンロード（遅延を追加）
-for number in tqdm(range(start_number, end_number + 1)):
-    image_name = f"R_{number:08d}.jpg"
+def fetch_image(session, limiter, manifest, image_name):
+    """
+    マニフェストを確認して必要な場合だけダウンロードし、取得状況を返す
+    """
     image_url = base_url + image_name
     save_path = os.path.join(save_directory, image_name)
+    entry = manifest.get(image_name)
+
+    # 存在しない・アクセスできない番号は再度リクエストしない
+    if entry is not None and entry.get('status') in (STATUS_MISSING, STATUS_FORBIDDEN):
+        return entry['status']
 
-    if download_image(image_url, save_path):
-        # ランダムな遅延を追加し、サーバ負荷を軽減
-        sleep_time = random.uniform(5, 20)  # 1～3秒の遅延
-        print(f"Waiting for {sleep_time:.2f} seconds...")
-        time.sleep(sleep_time)
+    if is_complete(entry, save_path):
+        if not revalidate:
+            return STATUS_COMPLETE
+        result = download_image(session, limiter, image_url, save_path, entry)
+    elif entry is None and os.path.exists(save_path):
+        # マニフェスト導入前にダウンロードしたファイルは取得済みとして登録
+        result = file_entry(save_path)
     else:
-        print(f"Skipping {image_name} due to errors.")
+        result = download_image(session, limiter, image_url, save_path)
+
+    manifest.update(image_name, result)
+    return result['status']
+
+def download_range(session, limiter, numbers, manifest):
+    """
+    番号の一覧の画像を並列にダウンロード
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for number in numbers:
+                image_name = f"R_{number:08d}.jpg"
+                futures[executor.submit(fetch_image, session, limiter, manifest, image_name)] = image_name
+
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                if future.result() == STATUS_FAILED:
+                    print(f"Skipping {futures[future]} due to errors.")
+    finally:
+        manifest.save()
+
+def image_exists(session, limiter, number, retries=3):
+    """
+    HEADリクエストで画像の有無を確認
+    2xx・304 は存在する、403・404・410 は存在しないとみなし、それ以外は再試行する
+    （429 と Retry-After 付きの403はレート制限として待機後に再試行する）
+    """
+    image_url = base_url + f"R_{number:08d}.jpg"
+    attempt = 0
+    while attempt < retries:
+        limiter.acquire()
+        try:
+            response = session.head(image_url, timeout=10, allow_redirects=True)
+            if response.status_code == 405:
+                # HEADに対応していない場合は本文を読まずにGETで確認
+                with session.get(image_url, stream=True, timeout=10) as response:
+                    pass
+            # 429 と Retry-After 付きの403はレート制限とみなして待機後に再試行
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if response.status_code == 429 or (response.status_code == 403 and retry_after is not None):
+                limiter.throttle(retry_after)
+                attempt += 1
+                print(f"{response.status_code}: Backing off {image_url} (attempt {attempt}/{retries})")
+                continue
+            if response.status_code in (403, 404, 410):
+                limiter.success()
+                return False
+            if 200 <= response.status_code < 300 or response.status_code == 304:
+                limiter.success()
+                return True
+            raise requests.exceptions.HTTPError(f"Unexpected status {response.status_code}", response=response)
+        except requests.exceptions.RequestException as e:
+            print(f"Error probing {image_url} (attempt {attempt + 1}/{retries}): {e}")
+            attempt += 1
+            time.sleep(2 ** attempt)
+    raise RuntimeError(f"画像の有無を確認できませんでした: {image_url}")
+
+def find_upper_bound(session, limiter, highest):
+    """
+    取得済みの最大番号から、指数的に間隔を広げて存在しない番号を見つけ、
+    その間を二分探索して存在する最大の番号を返す
+    discovery_window 個続けて存在しない場合のみ「存在しない」とみなして欠番を読み飛ばす
+    間隔が discovery_max_step を超えても存在しない番号が見つからない場合は、
+    そこまでに見つかった番号で打ち切る（残りは次回の実行で探索する）
+    """
+    probed = {}
+
+    def latest_in_window(number):
+        # number から discovery_window 個の中で存在する最大の番号
+        found = None
+        for candidate in range(number, number + discovery_window):
+            if candidate not in probed:
+                probed[candidate] = image_exists(session, limiter, candidate)
+            if probed[candidate]:
+                found = candidate
+        return found
+
+    # 存在する番号 low と、存在しない番号 high を指数探索で求める
+    low = highest
+    step = 1
+    while True:
+        if step > discovery_max_step:
+            print(f"警告: {discovery_max_step}件先まで画像が続いているため探索を打ち切りました: {low}")
+            return low
+        found = latest_in_window(highest + step)
+        if found is None:
+            high = highest + step
+            break
+        low = found
+        step *= 2
+
+    # low < n < high の範囲を二分探索
+    while high - low > 1:
+        middle = (low + high) // 2
+        found = latest_in_window(middle)
+        if found is None:
+            high = middle
+        else:
+            low = max(low, found)
+    print(f"{len(probed)}回のHEADリクエストで上限を検出しました: {low}")
+    return low
+
+def highest_downloaded(manifest):
+    """
+    マニフェスト上で取得済みの最大番号
+    """
+    numbers = [
+        int(image_name[2:10]) for image_name, entry in manifest.entries.items()
+        if entry.get('status') == STATUS_COMPLETE
+    ]
+    return max(numbers, default=None)
+
+def main():
+    # 保存用ディレクトリを作成
+    os.makedirs(save_directory, exist_ok=True)
+
+    manifest = FlierManifest(manifest_path)
+    limiter = HostRateLimiter(rate_per_second)
+    session = create_session(workers)
+    try:
+        if discover:
+            # 取得済みの最大番号（なければ START_NUMBER の1つ前）から新しい範囲を探す
+            highest = highest_downloaded(manifest)
+            if highest is None:
+                highest = int(os.getenv('START_NUMBER')) - 1
+            start_number = highest + 1
+            end_number = find_upper_bound(session, limiter, highest)
+        else:
+            # ダウンロードする範囲を指定
+            start_number = int(os.getenv('START_NUMBER'))
+            end_number = int(os.getenv('END_NUMBER'))
+
+        if end_number < start_number:
+            print("新しいフライヤー画像はありません")
+            return
+        download_range(session, limiter, range(start_number, end_number + 1), manifest)
+    finally:
+        session.close()
 
+if __name__ == "__main__":
+    main()
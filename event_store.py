@@ -0,0 +1,357 @@
+import os
+import re
+import sqlite3
+import time as t
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 公演を一意に特定する列（merge_events.detect_changes と同じキー）
+EVENT_KEY_COLUMNS = ['公演日', 'タイトル', '会場', '開演']
+EVENT_COLUMNS = ['公演日', 'タイトル', '会場', '開場', '開演', '終演', '出演者', '詳細', 'チケット', '画像']
+EVENT_VALUE_COLUMNS = [column for column in EVENT_COLUMNS if column not in EVENT_KEY_COLUMNS]
+
+PURCHASE_COLUMNS = [
+    '予約番号', '公演日', '開場', '開演', '公演名', '会場名', '所在地', '合計金額',
+    '枚数', '分配', '席種', '引取方法', '引換票番号', '購入日', 'ソートID'
+]
+PURCHASE_NUMERIC_COLUMNS = ['合計金額', '枚数', 'ソートID']
+# 手入力する列はスクレイピング結果で上書きしない
+PURCHASE_MANUAL_COLUMNS = ['分配']
+
+# 月別集計の基準日と、年月以外に集計する項目（'' は項目で分けない合計）
+ROLLUP_BASES = {'公演日': '公演年月', '購入日': '購入年月'}
+ROLLUP_DIMENSIONS = ['会場名', '席種', '引取方法']
+ROLLUP_SOURCE_COLUMNS = ['合計金額', '枚数', '公演年月', '購入年月'] + ROLLUP_DIMENSIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY,
+    公演日 TEXT NOT NULL,
+    タイトル TEXT NOT NULL,
+    会場 TEXT NOT NULL,
+    開場 TEXT,
+    開演 TEXT NOT NULL,
+    終演 TEXT,
+    出演者 TEXT,
+    詳細 TEXT,
+    チケット TEXT,
+    画像 TEXT,
+    updated_at TEXT,
+    UNIQUE (公演日, タイトル, 会場, 開演)
+);
+
+CREATE TABLE IF NOT EXISTS talents (
+    talent_id TEXT PRIMARY KEY,
+    talent_name TEXT,
+    merged_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS talent_events (
+    talent_id TEXT NOT NULL,
+    event_id INTEGER NOT NULL REFERENCES events (event_id),
+    position INTEGER NOT NULL,
+    開場 TEXT,
+    終演 TEXT,
+    出演者 TEXT,
+    詳細 TEXT,
+    チケット TEXT,
+    画像 TEXT,
+    PRIMARY KEY (talent_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS talent_events_event ON talent_events (event_id);
+
+CREATE TABLE IF NOT EXISTS purchases (
+    予約番号 TEXT PRIMARY KEY,
+    公演日 TEXT,
+    開場 TEXT,
+    開演 TEXT,
+    公演名 TEXT,
+    会場名 TEXT,
+    所在地 TEXT,
+    合計金額 INTEGER,
+    枚数 INTEGER,
+    分配 TEXT,
+    席種 TEXT,
+    引取方法 TEXT,
+    引換票番号 TEXT,
+    購入日 TEXT,
+    ソートID INTEGER
+);
+CREATE INDEX IF NOT EXISTS purchases_sort_id ON purchases (ソートID);
+
+CREATE TABLE IF NOT EXISTS purchase_rollups (
+    基準 TEXT NOT NULL,
+    年月 TEXT NOT NULL,
+    項目 TEXT NOT NULL,
+    値 TEXT NOT NULL,
+    合計金額 INTEGER NOT NULL,
+    枚数 INTEGER NOT NULL,
+    予約数 INTEGER NOT NULL,
+    PRIMARY KEY (基準, 年月, 項目, 値)
+);
+
+-- 集計済みの予約と、集計に加えた値（予約が更新された場合に差し引く）
+CREATE TABLE IF NOT EXISTS purchase_rollup_applied (
+    予約番号 TEXT PRIMARY KEY,
+    合計金額 INTEGER,
+    枚数 INTEGER,
+    公演年月 TEXT,
+    購入年月 TEXT,
+    会場名 TEXT,
+    席種 TEXT,
+    引取方法 TEXT
+);
+"""
+
+
+def csv_export_enabled():
+    """
+    CSVファイルへの書き出しを行うか
+    """
+    return os.getenv('CSV_EXPORT', 'true').lower() == 'true'
+
+def year_month(date_text):
+    """
+    'YYYY年MM月DD日（曜日）' 形式の日付から 'YYYY年MM月' を取得
+    """
+    match = re.search(r"\d{4}年\d{2}月", date_text or '')
+    return match.group(0) if match else None
+
+def rollup_rows(contribution):
+    """
+    予約1件が月別集計に加える (基準, 年月, 項目, 値) ごとの行
+    """
+    rows = []
+    for basis, month_column in ROLLUP_BASES.items():
+        month = contribution[month_column]
+        if month is None:
+            continue
+        rows.append((basis, month, '', ''))
+        for dimension in ROLLUP_DIMENSIONS:
+            rows.append((basis, month, dimension, contribution[dimension] or ''))
+    return rows
+
+def to_rows(df, columns):
+    """
+    DataFrameをSQLiteへ渡す行の一覧に変換（欠損値はNULL）
+    """
+    values = df[columns].astype(object)
+    return values.where(values.notna(), None).values.tolist()
+
+
+class EventStore:
+    """
+    公演・タレント別出演・購入履歴を保持するSQLiteのストア
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('EVENT_STORE_PATH', 'events.db')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def load_talent_events(self, talent_id):
+        """
+        タレントの前回の結合結果を返す（一度も保存していなければNone）
+        """
+        found = self.conn.execute(
+            "SELECT 1 FROM talents WHERE talent_id = ? AND merged_at IS NOT NULL", (str(talent_id),)
+        ).fetchone()
+        if not found:
+            return None
+
+        return pd.read_sql_query("""
+            SELECT e.公演日, e.タイトル, e.会場, te.開場, e.開演, te.終演,
+                   te.出演者, te.詳細, te.チケット, te.画像
+            FROM talent_events te
+            JOIN events e ON e.event_id = te.event_id
+            WHERE te.talent_id = ?
+            ORDER BY te.position
+        """, self.conn, params=(str(talent_id),))
+
+    def replace_talent_events(self, talent_id, talent_name, df):
+        """
+        公演をキーでupsertし、タレントの出演一覧を置き換える
+        """
+        now = t.strftime('%Y-%m-%d %H:%M:%S')
+        key_list = ', '.join(EVENT_KEY_COLUMNS)
+        update_list = ', '.join(f"{column} = excluded.{column}" for column in EVENT_VALUE_COLUMNS)
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO events ({', '.join(EVENT_COLUMNS)}, updated_at)
+                VALUES ({', '.join('?' for _ in EVENT_COLUMNS)}, ?)
+                ON CONFLICT ({key_list}) DO UPDATE SET {update_list}, updated_at = excluded.updated_at
+            """, [row + [now] for row in to_rows(df, EVENT_COLUMNS)])
+
+            self.conn.execute("DELETE FROM talent_events WHERE talent_id = ?", (str(talent_id),))
+            self.conn.executemany(f"""
+                INSERT OR REPLACE INTO talent_events (talent_id, event_id, position, {', '.join(EVENT_VALUE_COLUMNS)})
+                SELECT ?, event_id, ?, {', '.join('?' for _ in EVENT_VALUE_COLUMNS)}
+                FROM events WHERE {' AND '.join(f"{column} = ?" for column in EVENT_KEY_COLUMNS)}
+            """, [
+                [str(talent_id), position] + values + keys
+                for position, (values, keys) in enumerate(zip(
+                    to_rows(df, EVENT_VALUE_COLUMNS), to_rows(df, EVENT_KEY_COLUMNS)
+                ))
+            ])
+
+            self.conn.execute("""
+                INSERT INTO talents (talent_id, talent_name, merged_at) VALUES (?, ?, ?)
+                ON CONFLICT (talent_id) DO UPDATE SET talent_name = excluded.talent_name, merged_at = excluded.merged_at
+            """, (str(talent_id), talent_name, now))
+
+    def purchase_ids(self):
+        """
+        保存済みの予約番号の集合
+        """
+        return {row[0] for row in self.conn.execute("SELECT 予約番号 FROM purchases")}
+
+    def count_purchases(self):
+        return self.conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0]
+
+    def upsert_purchases(self, df):
+        """
+        予約番号をキーに購入履歴をupsert
+        """
+        df = df.reindex(columns=PURCHASE_COLUMNS).copy()
+        df['予約番号'] = df['予約番号'].astype(str)
+        for column in PURCHASE_NUMERIC_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+
+        update_list = ', '.join(
+            f"{column} = excluded.{column}" for column in PURCHASE_COLUMNS
+            if column != '予約番号' and column not in PURCHASE_MANUAL_COLUMNS
+        )
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO purchases ({', '.join(PURCHASE_COLUMNS)})
+                VALUES ({', '.join('?' for _ in PURCHASE_COLUMNS)})
+                ON CONFLICT (予約番号) DO UPDATE SET {update_list}
+            """, to_rows(df, PURCHASE_COLUMNS))
+            self._apply_rollups(df['予約番号'].tolist())
+
+    def update_manual_columns(self, df):
+        """
+        手入力する列（分配など）の値を予約番号ごとに反映（保存済みの予約のみ）
+        """
+        df = df.reindex(columns=['予約番号'] + PURCHASE_MANUAL_COLUMNS).copy()
+        df['予約番号'] = df['予約番号'].astype(str)
+        set_list = ', '.join(f"{column} = ?" for column in PURCHASE_MANUAL_COLUMNS)
+        with self.conn:
+            self.conn.executemany(
+                f"UPDATE purchases SET {set_list} WHERE 予約番号 = ?",
+                [row[1:] + row[:1] for row in to_rows(df, ['予約番号'] + PURCHASE_MANUAL_COLUMNS)]
+            )
+
+    def delete_purchases(self, reservation_ids):
+        """
+        指定した予約を購入履歴から削除し、月別集計から差し引く
+        """
+        reservation_ids = [str(reservation_id) for reservation_id in reservation_ids]
+        with self.conn:
+            self.conn.executemany("DELETE FROM purchases WHERE 予約番号 = ?", [(i,) for i in reservation_ids])
+            self._apply_rollups(reservation_ids)
+
+    def _apply_rollups(self, reservation_ids=None):
+        """
+        指定した予約（省略時は未集計の予約と削除された予約）を月別集計に反映
+        集計済みの予約は前回加えた値を差し引いてから加え直す（削除された予約は差し引くのみ）
+        """
+        if reservation_ids is None:
+            reservation_ids = [row[0] for row in self.conn.execute("""
+                SELECT p.予約番号 FROM purchases p
+                LEFT JOIN purchase_rollup_applied a ON a.予約番号 = p.予約番号
+                WHERE a.予約番号 IS NULL
+                UNION ALL
+                SELECT a.予約番号 FROM purchase_rollup_applied a
+                LEFT JOIN purchases p ON p.予約番号 = a.予約番号
+                WHERE p.予約番号 IS NULL
+            """)]
+
+        for reservation_id in reservation_ids:
+            applied = self.conn.execute(
+                f"SELECT {', '.join(ROLLUP_SOURCE_COLUMNS)} FROM purchase_rollup_applied WHERE 予約番号 = ?",
+                (reservation_id,)
+            ).fetchone()
+            purchase = self.conn.execute(
+                "SELECT 合計金額, 枚数, 公演日, 購入日, 会場名, 席種, 引取方法 FROM purchases WHERE 予約番号 = ?",
+                (reservation_id,)
+            ).fetchone()
+            if purchase is None:
+                if applied is not None:
+                    self._add_rollup(dict(zip(ROLLUP_SOURCE_COLUMNS, applied)), -1)
+                    self.conn.execute("DELETE FROM purchase_rollup_applied WHERE 予約番号 = ?", (reservation_id,))
+                continue
+            total, quantity, event_date, purchase_date, venue, seat_type, pickup_method = purchase
+            new = dict(zip(ROLLUP_SOURCE_COLUMNS, [
+                int(total or 0), int(quantity or 0), year_month(event_date), year_month(purchase_date),
+                venue, seat_type, pickup_method
+            ]))
+
+            if applied is not None:
+                old = dict(zip(ROLLUP_SOURCE_COLUMNS, applied))
+                if old == new:
+                    continue
+                self._add_rollup(old, -1)
+            self._add_rollup(new, 1)
+            self.conn.execute(f"""
+                INSERT OR REPLACE INTO purchase_rollup_applied (予約番号, {', '.join(ROLLUP_SOURCE_COLUMNS)})
+                VALUES (?, {', '.join('?' for _ in ROLLUP_SOURCE_COLUMNS)})
+            """, [reservation_id] + [new[column] for column in ROLLUP_SOURCE_COLUMNS])
+
+    def _add_rollup(self, contribution, sign):
+        self.conn.executemany("""
+            INSERT INTO purchase_rollups (基準, 年月, 項目, 値, 合計金額, 枚数, 予約数) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (基準, 年月, 項目, 値) DO UPDATE SET
+                合計金額 = 合計金額 + excluded.合計金額, 枚数 = 枚数 + excluded.枚数, 予約数 = 予約数 + excluded.予約数
+        """, [
+            row + (sign * contribution['合計金額'], sign * contribution['枚数'], sign)
+            for row in rollup_rows(contribution)
+        ])
+        if sign < 0:
+            self.conn.execute("DELETE FROM purchase_rollups WHERE 予約数 = 0")
+
+    def update_rollups(self):
+        """
+        まだ集計していない予約と削除された予約を月別集計に反映
+        """
+        with self.conn:
+            self._apply_rollups()
+
+    def rebuild_rollups(self):
+        """
+        月別集計を購入履歴全体から作り直す
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM purchase_rollups")
+            self.conn.execute("DELETE FROM purchase_rollup_applied")
+            self._apply_rollups()
+
+    def load_rollups(self, dimension=''):
+        """
+        月別集計を (基準, 年月, 値, 合計金額, 枚数, 予約数) で返す
+        dimension を指定するとその項目の値ごとの集計
+        """
+        return pd.read_sql_query("""
+            SELECT 基準, 年月, 値, 合計金額, 枚数, 予約数 FROM purchase_rollups
+            WHERE 項目 = ? ORDER BY 基準, 年月, 値
+        """, self.conn, params=(dimension,))
+
+    def load_purchases(self):
+        """
+        購入履歴をソートIDの降順で返す
+        """
+        return pd.read_sql_query(
+            f"SELECT {', '.join(PURCHASE_COLUMNS)} FROM purchases ORDER BY ソートID DESC",
+            self.conn
+        )
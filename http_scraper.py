@@ -0,0 +1,224 @@
+import os
+import re
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+import lxml.html
+from dotenv import load_dotenv
+from browser_session import USER_AGENT
+
+load_dotenv()
+
+# ブロック要素の前後では innerText と同様に改行を入れる
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt', 'figcaption',
+    'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'li',
+    'main', 'nav', 'ol', 'p', 'section', 'table', 'tr', 'ul'
+}
+SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+
+class NeedsBrowser(Exception):
+    """
+    サーバーが返すHTMLだけでは取得できず、Seleniumでの取得が必要なページ
+    """
+
+
+class HttpClient:
+    """
+    コネクションを使い回すHTTPクライアント
+    """
+
+    def __init__(self, pool_size=None, timeout=10):
+        pool_size = pool_size or int(os.getenv('HTTP_POOL_SIZE', 4))
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def load_cookies(self, cookies):
+        """
+        WebDriverのCookie（driver.get_cookies() の形式）を引き継ぐ
+        """
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/')
+            )
+
+    def fetch_document(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_html(response.content, response.url)
+
+    def fetch_schedule_pages(self, url, stages=None, skip=None):
+        """
+        劇場ページの各月（ステージがあればステージごと）のページを取得
+        戻り値は (ステージ, 月の表示名, ページ) のリスト
+        skip(ステージ, 月の表示名) が真を返す月は取得せず、ページをNoneとする
+        """
+        document = self.fetch_document(url)
+        if not stages:
+            return [(None, text, page) for text, page in self._fetch_months(document, None, skip)]
+
+        pages = []
+        for stage in stages:
+            stage_document = self.fetch_document(find_link_url(document, stage))
+            pages.extend((stage, text, page) for text, page in self._fetch_months(stage_document, stage, skip))
+        return pages
+
+    def _fetch_months(self, document, stage, skip):
+        months = []
+        for text, month_url in parse_month_links(document):
+            if skip and skip(stage, text):
+                months.append((text, None))
+            else:
+                months.append((text, self.fetch_document(month_url)))
+        return months
+
+
+def parse_html(content, base_url=None):
+    """
+    HTMLを解析（保存済みHTMLからの取得にも使用）
+    """
+    return lxml.html.document_fromstring(content, base_url=base_url)
+
+def region_html(document, selector):
+    """
+    セレクタに一致する要素のHTMLを連結して返す（キャッシュのハッシュ値計算用）
+    """
+    return ''.join(lxml.html.tostring(el, encoding='unicode', with_tail=False) for el in document.cssselect(selector))
+
+def inner_text(element):
+    """
+    要素のテキストをブラウザの innerText に近い形で取得
+    """
+    parts = []
+    _collect_text(element, parts)
+    lines = ''.join(parts).split('\n')
+    lines = [re.sub(r'[ \t\r\f\v]+', ' ', line).strip() for line in lines]
+    return '\n'.join(line for line in lines if line)
+
+def _collect_text(element, parts):
+    tag = element.tag if isinstance(element.tag, str) else ''
+    if tag in SKIP_TAGS:
+        if element.tail:
+            parts.append(element.tail)
+        return
+    if tag == 'br':
+        parts.append('\n')
+    elif tag in BLOCK_TAGS:
+        parts.append('\n')
+    if tag and element.text:
+        parts.append(element.text)
+    for child in element:
+        _collect_text(child, parts)
+    if tag in BLOCK_TAGS:
+        parts.append('\n')
+    if element.tail:
+        parts.append(element.tail)
+
+def select_text(root, selector):
+    found = root.cssselect(selector)
+    if not found:
+        return '-'
+    return inner_text(found[0]) or '-'
+
+def select_url(root, selector, attribute):
+    found = root.cssselect(selector)
+    if not found or not found[0].get(attribute):
+        return '-'
+    return urljoin(root.base_url or '', found[0].get(attribute))
+
+def parse_feed_items(document):
+    """
+    タレントページのHTMLからフィード項目を取得
+    talent_tickets.FEED_ITEMS_SCRIPT と同じ形式で返す
+    """
+    if not document.cssselect('#feed_ticket_info2'):
+        raise NeedsBrowser('#feed_ticket_info2 が見つかりません')
+
+    items = []
+    for event in document.cssselect('#feed_ticket_info2 .feed-item-container'):
+        items.append({
+            'title': select_text(event, '.feed-ticket-title'),
+            'date': select_text(event, '.opt-feed-ft-dateside p:first-child'),
+            'time': select_text(event, '.opt-feed-ft-dateside p:last-child'),
+            'members': select_text(event, '.opt-feed-ft-element-member'),
+            'venue': select_text(event, '.opt-feed-ft-element-venue'),
+            'image': select_url(event, '.feed-item-img', 'src'),
+            'link': select_url(event, '.feed-item-link', 'href')
+        })
+    return items
+
+def parse_schedule_blocks(document):
+    """
+    劇場ページのHTMLから表示中の月のスケジュールブロックを取得
+    theater_schedules.SCHEDULE_BLOCKS_SCRIPT と同じ形式で返す
+    """
+    if not document.cssselect('.schedule-block, .calendar-month'):
+        raise NeedsBrowser('スケジュールが見つかりません')
+
+    blocks = []
+    for block in document.cssselect('.schedule-block'):
+        times = block.cssselect('.schedule-time')
+        details = block.cssselect('.schedule-detail')
+
+        entries = []
+        for time_block, detail_block in zip(times, details):
+            member = detail_block.cssselect('dd.schedule-detail-member')
+            entries.append({
+                'title': select_text(time_block, 'strong'),
+                'times': select_text(time_block, 'span'),
+                'members': inner_text(member[0]) if member else None,
+                'detail': select_text(detail_block, 'dl:nth-of-type(3) dd'),
+                'link': select_url(detail_block, '.btns a:not(.is-pink)', 'href')
+            })
+        blocks.append({'id': block.get('id', ''), 'entries': entries})
+    return blocks
+
+def parse_reservation_details(document):
+    """
+    購入履歴の予約詳細ページのHTMLから (開場, 開演, 引取方法, 引換票番号, 合計金額) を取得
+    項目が1つもない場合（ログイン切れ等）はブラウザでの取得が必要
+    """
+    labels = ['lbl_HallOpenTime', 'lbl_ShowStartTime', 'lbl_GetMethod', 'lbl_Caution2', 'lbl_TotalMoney']
+    found = [document.get_element_by_id(label, None) for label in labels]
+    if all(element is None for element in found):
+        raise NeedsBrowser('予約詳細が見つかりません')
+    return tuple(inner_text(element) if element is not None else '' for element in found)
+
+def parse_month_links(document):
+    """
+    月切り替えリンクの表示名とURLを取得
+    JavaScriptで切り替えるリンクの場合はブラウザでの取得が必要
+    """
+    links = []
+    for link in document.cssselect('.calendar-month a'):
+        links.append((inner_text(link), resolve_link(link)))
+    return links
+
+def find_link_url(document, text):
+    """
+    表示名が一致するリンクのURLを取得
+    """
+    for link in document.iter('a'):
+        if (link.text or '') == text:
+            return resolve_link(link)
+    raise NeedsBrowser(f"リンク {text} が見つかりません")
+
+def resolve_link(link):
+    href = (link.get('href') or '').strip()
+    if not href or href.startswith('#') or href.lower().startswith('javascript:'):
+        raise NeedsBrowser(f"リンク {inner_text(link)} はJavaScriptで動作します")
+    return urljoin(link.base_url or '', href)
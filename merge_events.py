@@ -1,14 +1,18 @@
 import pandas as pd
+import numpy as np
 import os
 import logging
 import json
 from dotenv import load_dotenv
 import csv
 import unicodedata
+import html
 import re
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from talent_matcher import TalentMatcher
+from columnar import format_event_columns, load_events
+from notifier import NotificationDispatcher
+from template_engine import Raw, load_template
+from event_store import EventStore, EVENT_KEY_COLUMNS, EVENT_VALUE_COLUMNS, csv_export_enabled
 
 # ログの設定
 logging.basicConfig(level=logging.INFO)
@@ -16,28 +20,41 @@ logging.basicConfig(level=logging.INFO)
 # .envの読み込み
 load_dotenv()
 
+# タイトルから削除する表記
+TITLE_NOISE_PATTERN = r"\s*(\d{1,2}:\d{2}の部|その[壱弐参]|\d{1,2}月公演)"
+
+# 元データの列と出力する列名
+OUTPUT_COLUMNS = {
+    'Date': '公演日',
+    'Title': 'タイトル',
+    'Venue': '会場',
+    'OpenTime': '開場',
+    'StartTime': '開演',
+    'EndTime': '終演',
+    'Members': '出演者',
+    'Detail': '詳細',
+    'Link': 'チケット',
+    'Image': '画像'
+}
+
+# 更新項目として通知する列
+UPDATE_FIELDS = ['公演日', '会場', '開演', '出演者', '詳細', '画像']
+
 def load_data():
     """
-    CSVファイルと環境変数のロード
+    スクレイピング結果（Arrowファイルがあればそちらを優先）と環境変数のロード
     """
-    talent_df = pd.read_csv('talent_tickets.csv')
-    theater_df = pd.read_csv('theater_schedules.csv')
+    talent_df = load_events('talent_tickets.csv', 'talent_tickets.arrow')
+    theater_df = load_events('theater_schedules.csv', 'theater_schedules.arrow')
     talents = json.loads(os.getenv('TALENTS'))
     return talent_df, theater_df, talents
 
-def filter_schedule(theater_df, talent_name):
-    """
-    指定タレントが出演するスケジュール情報を抽出
-    """
-    filtered_df = theater_df[theater_df['Members'].str.contains(talent_name, na=False)]
-    return filtered_df
-
-def filter_talents(talent_df, talent_name):
+def build_talent_index(df, column, talents):
     """
-    指定タレントのスケジュール情報を抽出
+    タレント名ごとに、指定列に名前を含む行のインデックスを1回の走査で求める
     """
-    filtered_df = talent_df[talent_df['TalentName'].str.contains(talent_name, na=False)]
-    return filtered_df
+    matcher = TalentMatcher(talent['name'] for talent in talents)
+    return matcher.index(df[column])
 
 def normalize_title(title):
     """
@@ -46,185 +63,210 @@ def normalize_title(title):
     # 英数字記号を半角に
     title = unicodedata.normalize('NFKC', title)
     # 特定のキーワード削除
-    title = re.sub(r"\s*(\d{1,2}:\d{2}の部|その[壱弐参]|\d{1,2}月公演)", "", title)
+    title = re.sub(TITLE_NOISE_PATTERN, "", title)
     return title.strip()
 
-def merge_data(talent_data, schedule_data):
+def normalize_titles(titles):
     """
-    タレントデータとスケジュールデータを結合
+    タイトルの表記揺れを列単位でまとめて正規化（normalize_title と同じ変換）
     """
-    talent_data.loc[:, 'Title'] = talent_data['Title'].apply(normalize_title)
-    schedule_data.loc[:, 'Title'] = schedule_data['Title'].apply(normalize_title)
+    return (titles.str.normalize('NFKC')
+            .str.replace(TITLE_NOISE_PATTERN, '', regex=True)
+            .str.strip())
 
+def concat_events(talent_data, schedule_data):
+    """
+    タイトル正規化済みのタレントデータとスケジュールデータを連結し、出力形式に整形
+    """
     merged_df = pd.concat([talent_data, schedule_data], ignore_index=True)
 
-    # 欠損値を補填
+    # 欠損値を補填（カテゴリ型の列は '-' を補填できないため文字列に戻す）
+    merged_df = merged_df.astype({column: object for column in merged_df.select_dtypes('category').columns})
     merged_df.fillna('-', inplace=True)
 
     # 出力データを整形
-    return merged_df[[
-        'Date', 'Title', 'Venue', 'OpenTime', 'StartTime',
-        'EndTime', 'Members', 'Detail', 'Link', 'Image'
-    ]].rename(columns={
-        'Date': '公演日',
-        'Title': 'タイトル',
-        'Venue': '会場',
-        'OpenTime': '開場',
-        'StartTime': '開演',
-        'EndTime': '終演',
-        'Members': '出演者',
-        'Detail': '詳細',
-        'Link': 'チケット',
-        'Image': '画像'
-    })
+    return merged_df[list(OUTPUT_COLUMNS)].rename(columns=OUTPUT_COLUMNS)
 
 def duplicate_merge(merged_data):
     """
     重複データをマージ
+    戻り値のインデックスは公演のキーでグループ化した際の番号（groupby の ngroup と同じ）
     """
-    def merge_rows(row):
-        non_hyphen_values = row[row != '-']
-        return non_hyphen_values.iloc[0] if not non_hyphen_values.empty else '-'
-
-    merged_data = merged_data.groupby(['公演日', 'タイトル', '会場', '開演']).agg({
-        '開場': lambda x: merge_rows(x),
-        '終演': lambda x: merge_rows(x),
-        '出演者': lambda x: merge_rows(x),
-        '詳細': lambda x: merge_rows(x),
-        'チケット': lambda x: merge_rows(x),
-        '画像': lambda x: merge_rows(x)
-    }).reset_index()
+    # 各列で '-' 以外の最初の値を採用
+    values = merged_data[EVENT_VALUE_COLUMNS]
+    merged_data = (merged_data[EVENT_KEY_COLUMNS].join(values.mask(values == '-'))
+                   .groupby(EVENT_KEY_COLUMNS)[EVENT_VALUE_COLUMNS].first()
+                   .fillna('-')
+                   .reset_index())
 
     # 列の順序を指定
-    merged_data = merged_data[[
-        '公演日', 'タイトル', '会場', '開場', '開演', '終演',
-        '出演者', '詳細', 'チケット', '画像'
-    ]]
+    merged_data = merged_data[list(OUTPUT_COLUMNS.values())]
 
     # 行をソート
     merged_data = merged_data.sort_values(by=['公演日', '開場', '開演'])
 
     return merged_data
 
-def detect_changes(new_data, existing_file):
+def build_talent_schedules(talent_df, theater_df, talents, talent_index, schedule_index):
+    """
+    全タレント分のデータを1つの表として結合・重複マージし、タレントごとのスケジュールの一覧を返す
+    各公演は出演タレント数によらず1回だけマージし、タレントごとの一覧は元データの行から
+    公演の番号を引いて切り出す
     """
-    既存ファイルと新規データを比較し、差分を抽出
+    # Arrowファイルから読み込んだ型付きの日付・時刻は、重複を除いた値だけを文字列表記にする
+    talent_data = format_event_columns(talent_df)
+    schedule_data = format_event_columns(theater_df)
+    talent_data = talent_data.assign(Title=normalize_titles(talent_data['Title']))
+    schedule_data = schedule_data.assign(Title=normalize_titles(schedule_data['Title']))
+
+    combined = concat_events(talent_data, schedule_data)
+    # 元データの各行が属する公演の番号
+    event_ids = combined.groupby(EVENT_KEY_COLUMNS).ngroup().to_numpy()
+    merged_data = duplicate_merge(combined)
+
+    # 公演の番号から、並べ替え後の表の行位置を引く
+    positions = np.empty(len(merged_data), dtype=np.intp)
+    positions[merged_data.index.to_numpy()] = np.arange(len(merged_data))
+    merged_data = merged_data.reset_index(drop=True)
+
+    schedules = []
+    for talent in talents:
+        rows = np.concatenate([
+            talent_df.index.get_indexer(talent_index[talent['name']]),
+            len(talent_df) + theater_df.index.get_indexer(schedule_index[talent['name']])
+        ]).astype(np.intp)
+        schedules.append(merged_data.iloc[np.sort(positions[np.unique(event_ids[rows])])].reset_index(drop=True))
+    return schedules
+
+def detect_changes(new_data, existing_file, existing_data=None):
     """
-    if not os.path.exists(existing_file):
-        logging.info(f"既存ファイルが見つかりません: {existing_file}")
-        return new_data.assign(フラグ='flag-new')
+    既存データ（指定がなければ既存ファイル）と新規データを比較し、差分を抽出
+    """
+    if existing_data is None:
+        if not os.path.exists(existing_file):
+            logging.info(f"既存ファイルが見つかりません: {existing_file}")
+            return new_data.assign(フラグ='flag-new')
+        existing_data = pd.read_csv(existing_file, encoding='utf-8-sig')
 
-    existing_data = pd.read_csv(existing_file, encoding='utf-8-sig')
-    diff = pd.concat([new_data, existing_data]).drop_duplicates(keep=False)
+    # 行全体のハッシュ値で、新旧どちらか一方にしかない行を抽出
+    combined = pd.concat([new_data, existing_data], ignore_index=True)
+    diff = combined[~combined.duplicated(keep=False)]
 
     # 差分データの中で重複があれば、不足する値を補い合う
-    diff = diff.groupby(['公演日', 'タイトル', '会場', '開演']).agg({
-        '開場': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-',
-        '終演': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-',
-        '出演者': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-',
-        '詳細': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-',
-        'チケット': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-',
-        '画像': lambda x: x.dropna().iloc[0] if not x.dropna().empty else '-'
-    }).reset_index()
-
-    # 新規追加と更新のフラグを設定
-    existing_keys = existing_data[['公演日', 'タイトル', '会場', '開演']].apply(tuple, axis=1).tolist()
-    diff['フラグ'] = diff.apply(lambda row: 'flag-new' if (row['公演日'], row['タイトル'], row['会場'], row['開演']) not in existing_keys else 'flag-update', axis=1)
+    diff = diff.groupby(EVENT_KEY_COLUMNS)[EVENT_VALUE_COLUMNS].first().fillna('-').reset_index()
+
+    # 新規追加と更新のフラグを設定（キーによる結合で既存行を照合）
+    existing_rows = existing_data.drop_duplicates(subset=EVENT_KEY_COLUMNS).set_index(EVENT_KEY_COLUMNS)
+    diff_keys = pd.MultiIndex.from_frame(diff[EVENT_KEY_COLUMNS])
+    is_update = diff_keys.isin(existing_rows.index)
+    diff['フラグ'] = np.where(is_update, 'flag-update', 'flag-new')
 
     # 更新された項目を検出
-    for idx, row in diff.iterrows():
-        if row['フラグ'] == 'flag-update':
-            existing_row = existing_data[(existing_data['公演日'] == row['公演日']) & 
-                                         (existing_data['タイトル'] == row['タイトル']) & 
-                                         (existing_data['会場'] == row['会場']) & 
-                                         (existing_data['開演'] == row['開演'])]
-            updated_fields = []
-            for field in ['公演日', '会場', '開演', '出演者', '詳細', '画像']:
-                if row[field] != existing_row[field].values[0]:
-                    updated_fields.append(field)
-            diff.at[idx, '更新項目'] = ', '.join(updated_fields)
+    if is_update.any():
+        updated = diff[is_update]
+        matched = existing_rows.reindex(diff_keys[is_update]).reset_index()
+        changed = np.column_stack([
+            updated[field].to_numpy() != matched[field].to_numpy()
+            for field in UPDATE_FIELDS
+        ])
+        diff.loc[is_update, '更新項目'] = [
+            ', '.join(field for field, is_changed in zip(UPDATE_FIELDS, row) if is_changed)
+            for row in changed
+        ]
 
     return diff
 
-def load_template(template_path):
+def send_email_notification(subject, html_body, text_body=None):
     """
-    テンプレートファイルを読み込む
+    メール通知を1通だけ送信
     """
-    with open(template_path, 'r', encoding='utf-8') as file:
-        template = file.read()
-    return template
+    with NotificationDispatcher(digest=False) as dispatcher:
+        dispatcher.add(subject, html_body, text_body=text_body)
 
-def send_email_notification(subject, html_body):
+def render_event_details(diff_data):
     """
-    メール通知を送信
+    差分データの全行をイベント詳細のHTML・テキストにまとめて変換
     """
-    smtp_server = os.getenv('SMTP_SERVER')
-    smtp_port = int(os.getenv('SMTP_PORT', 587))
-    email_address = os.getenv('EMAIL_ADDRESS')
-    email_password = os.getenv('EMAIL_PASSWORD')
-    sender = os.getenv('SENDER')
-    to_email = os.getenv('TO_EMAIL')
-
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = sender
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(html_body, 'html'))
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(email_address, email_password)
-            server.send_message(msg)
-            logging.info("通知メールが送信されました。")
-    except Exception as e:
-        logging.error(f"メール送信エラー: {e}")
-
-def send_notification(diff_data, talent_name):
+    flags = diff_data['フラグ']
+    is_update = flags == 'flag-update'
+    has_image = diff_data['画像'] != '-'
+    updated = diff_data['更新項目'] if '更新項目' in diff_data else pd.Series('', index=diff_data.index)
+
+    # 行ごとに変わる値を列単位でまとめて作成
+    details_escaped = diff_data['詳細'].map(html.escape).str.replace(' ', '<br>', regex=False)
+    images = [
+        f"<div class='img-box'><img src='{html.escape(image)}' alt='{html.escape(title)}'></div>" if show else ''
+        for image, title, show in zip(diff_data['画像'], diff_data['タイトル'], has_image)
+    ]
+    html_rows = diff_data.assign(
+        詳細=[Raw(value) for value in details_escaped],
+        画像=[Raw(value) for value in images],
+        更新項目=np.where(is_update, updated.astype(str) + ' 更新', '')
+    ).to_dict('records')
+    text_rows = diff_data.assign(
+        フラグ=np.where(is_update, 'UPDATE', 'NEW'),
+        詳細=diff_data['詳細'].str.replace(' ', '\n', regex=False)
+    ).to_dict('records')
+
+    event_details_html = load_template('email/event_details.html').render_rows(html_rows)
+    event_details_text = load_template('email/event_details.txt').render_rows(text_rows, '\n\n')
+    return event_details_html, event_details_text
+
+def render_email(talent_name, event_details_html, event_details_text):
+    """
+    通知メールのHTML・テキスト本文
+    """
+    html_body = load_template('email/new_events.html').render(
+        {'talent_name': talent_name, 'event_details': Raw(event_details_html)}
+    )
+    text_body = load_template('email/new_events.txt').render(
+        {'talent_name': talent_name, 'event_details': event_details_text}
+    )
+    return html_body, text_body
+
+def build_digest_email(sections):
+    """
+    全タレント分の通知を1通のダイジェストにまとめる
+    件名はタレント数と件数だけにし、タレント名は本文に記載する
+    """
+    talent_names = '、'.join(section['talent_name'] for section in sections)
+    event_count = sum(section['event_count'] for section in sections)
+    subject = f"新規イベント通知（{len(sections)}名・{event_count}件）"
+    event_details_html = ''.join(
+        f"<h2>{html.escape(section['talent_name'])}</h2>{section['event_details']}" for section in sections
+    )
+    event_details_text = '\n\n'.join(
+        f"■ {section['talent_name']}\n\n{section['event_details_text']}" for section in sections
+    )
+    html_body, text_body = render_email(talent_names, event_details_html, event_details_text)
+    return subject, html_body, text_body
+
+def send_notification(diff_data, talent_name, dispatcher=None):
     """
     差分データを基に通知を送信
+    dispatcher を指定した場合は送信せずに追加し、実行の最後にまとめて送信する
     """
     if diff_data.empty:
         logging.info(f"{talent_name} に新規イベントはありません")
         return
 
     subject = f"{talent_name} の新規イベント通知"
-    html_template = load_template('email/new_events.html')
-    event_details_html_template = load_template('email/event_details.html')
-
-    html_body = html_template.replace('{{talent_name}}', talent_name)
-
-    event_details_html = ""
-    for idx, row in diff_data.iterrows():
-        event_detail_html = event_details_html_template
-
-        event_detail_html = event_detail_html.replace('{{タイトル}}', row['タイトル'])
-        event_detail_html = event_detail_html.replace('{{公演日}}', row['公演日'])
-        event_detail_html = event_detail_html.replace('{{会場}}', row['会場'])
-        event_detail_html = event_detail_html.replace('{{開演}}', row['開演'])
-        event_detail_html = event_detail_html.replace('{{出演者}}', row['出演者'])
-        event_detail_html = event_detail_html.replace('{{詳細}}', row['詳細'].replace(' ', '<br>'))
-        event_detail_html = event_detail_html.replace('{{チケット}}', row['チケット'])
-        event_detail_html = event_detail_html.replace('{{フラグ}}', row['フラグ'])
-        if row['画像'] != '-':
-            event_detail_html = event_detail_html.replace('{{画像}}', f"<div class='img-box'><img src='{row['画像']}' alt='{row['タイトル']}'></div>")
-        else:
-            event_detail_html = event_detail_html.replace('{{画像}}', '')
-
-        if row['フラグ'] == 'flag-update':
-            event_detail_html = event_detail_html.replace('{{更新項目}}', f"{row['更新項目']} 更新")
-        else:
-            event_detail_html = event_detail_html.replace('{{更新項目}}', '')
-
-        event_details_html += event_detail_html
-
-        # debug: コンソールに出力
-        print(f"新しいイベントが追加されました: {row['タイトル']}")
-
-    html_body = html_body.replace('{{event_details}}', event_details_html)
-
-    send_email_notification(subject, html_body)
+    event_details_html, event_details_text = render_event_details(diff_data)
+    html_body, text_body = render_email(talent_name, event_details_html, event_details_text)
+
+    # debug: コンソールに出力
+    for title in diff_data['タイトル']:
+        print(f"新しいイベントが追加されました: {title}")
+
+    if dispatcher is None:
+        send_email_notification(subject, html_body, text_body)
+    else:
+        dispatcher.add(subject, html_body, {
+            'talent_name': talent_name,
+            'event_details': event_details_html,
+            'event_details_text': event_details_text,
+            'event_count': len(diff_data)
+        }, text_body)
 
 def save_to_csv(final_df, talent_id, talent_name):
     """
@@ -236,35 +278,57 @@ def save_to_csv(final_df, talent_id, talent_name):
     final_df.to_csv(output_filename, index=False, encoding='utf-8-sig', quoting=csv.QUOTE_ALL)
     logging.info(f"CSVファイルを出力しました: {output_filename}")
 
-def main():
+def merge_schedules(talent_df, theater_df, talents):
     """
-    メイン処理
+    全タレント分のデータを結合・重複マージし、タレントごとのスケジュールの一覧を返す
     """
-    talent_df, theater_df, talents = load_data()
-
-    for talent in talents:
-        talent_id = talent['id']
-        talent_name = talent['name']
+    # 出演者・タレント名の索引を全タレント分まとめて作成
+    schedule_index = build_talent_index(theater_df, 'Members', talents)
+    talent_index = build_talent_index(talent_df, 'TalentName', talents)
 
-        logging.info(f"{talent_name} のデータを処理しています")
+    # 全タレント分のデータを一括で結合・重複マージ
+    return build_talent_schedules(talent_df, theater_df, talents, talent_index, schedule_index)
 
-        # スケジュールのフィルタリング
-        filtered_schedule = filter_schedule(theater_df, talent_name)
-        # タレントスケジュールのフィルタリング
-        filtered_talent = filter_talents(talent_df, talent_name)
-
-        # データの結合
-        merged_data = merge_data(filtered_talent, filtered_schedule)
-        # 重複データをマージ
-        merged_data = duplicate_merge(merged_data)
+def update_schedules(talents, talent_schedules):
+    """
+    タレントごとに前回との差分を検出して結合結果を保存し、差分の一覧を返す
+    """
+    diffs = []
+    with EventStore() as store:
+        for talent, merged_data in zip(talents, talent_schedules):
+            talent_id = talent['id']
+            talent_name = talent['name']
+
+            logging.info(f"{talent_name} のデータを処理しています")
+
+            # 前回の結合結果との差分を検出（ストアに未保存なら既存ファイルと比較）
+            existing_file = f'schedules/{talent_id}_{talent_name}.csv'
+            existing_data = store.load_talent_events(talent_id)
+            diffs.append(detect_changes(merged_data, existing_file, existing_data))
+
+            # ストアへの保存とCSVへの出力
+            store.replace_talent_events(talent_id, talent_name, merged_data)
+            if csv_export_enabled():
+                save_to_csv(merged_data, talent_id, talent_name)
+    return diffs
+
+def notify_changes(talents, diffs):
+    """
+    全タレントの差分を1本の接続でまとめて通知
+    """
+    with NotificationDispatcher(compose_digest=build_digest_email) as dispatcher:
+        for talent, diff_data in zip(talents, diffs):
+            send_notification(diff_data, talent['name'], dispatcher)
 
-        # 既存ファイルとの差分を検出
-        existing_file = f'schedules/{talent_id}_{talent_name}.csv'
-        diff_data = detect_changes(merged_data, existing_file)
+def main():
+    """
+    メイン処理
+    """
+    talent_df, theater_df, talents = load_data()
 
-        # CSVへの出力
-        save_to_csv(merged_data, talent_id, talent_name)
-        send_notification(diff_data, talent_name)
+    talent_schedules = merge_schedules(talent_df, theater_df, talents)
+    diffs = update_schedules(talents, talent_schedules)
+    notify_changes(talents, diffs)
 
     logging.info("全タレントの処理が完了しました")
 
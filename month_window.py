@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time as t
+from dotenv import load_dotenv
+from page_cache import PageCache, fingerprint
+
+load_dotenv()
+
+
+def parse_month(month_text):
+    """
+    月リンクの表示名から (年, 月) を取得（年の表記がなければ年はNone）
+    """
+    match = re.search(r'(?:(\d{4})\D{0,3})?(\d{1,2})\s*月', month_text or '')
+    if not match:
+        return None
+    month = int(match.group(2))
+    if not 1 <= month <= 12:
+        return None
+    return (int(match.group(1)) if match.group(1) else None), month
+
+
+class MonthSequence:
+    """
+    月リンクを表示順に受け取り、年の表記がない月の年を補う
+    先頭の月は今日に最も近い年とし、以降は前の月より小さい月になった時点で翌年とみなす
+    """
+
+    def __init__(self, today=None):
+        self.today = today or t.localtime()
+        self.previous = None
+
+    def resolve(self, month_text):
+        parsed = parse_month(month_text)
+        if parsed is None:
+            return None
+        year, month = parsed
+        if year is None:
+            if self.previous is None:
+                current = self.today.tm_year * 12 + self.today.tm_mon
+                year = min((self.today.tm_year - 1, self.today.tm_year, self.today.tm_year + 1),
+                           key=lambda y: abs(y * 12 + month - current))
+            else:
+                year = self.previous[0] + (1 if month < self.previous[1] else 0)
+        self.previous = (year, month)
+        return self.previous
+
+
+def resolve_months(month_texts, today=None):
+    """
+    月リンクの表示名の一覧（表示順）から各月の (年, 月) を求める（解析できない月はNone）
+    """
+    sequence = MonthSequence(today)
+    return [sequence.resolve(text) for text in month_texts]
+
+
+class MonthWindow:
+    """
+    劇場・月ごとの取得日時と取得結果を保持し、再取得が必要な月を判定する
+    今月・来月は毎回取得し、過去の月は保存済みの結果を使い、
+    再来月以降は一定時間ごとに取得する
+    """
+
+    def __init__(self, enabled=None, path=None, interval_hours=None):
+        if enabled is None:
+            enabled = os.getenv('THEATER_INCREMENTAL', 'false').lower() == 'true'
+        self.enabled = enabled
+        self.interval = float(interval_hours or os.getenv('THEATER_FAR_MONTH_INTERVAL_HOURS', 24)) * 3600
+        self.state = PageCache(
+            path=path or os.getenv('THEATER_MONTH_STATE_PATH', 'cache/theater_months.json'),
+            enabled=enabled
+        )
+        # 今回の実行で参照・記録したキー（表示されなくなった過去の月の削除に使う）
+        self.used = set()
+
+    @staticmethod
+    def key(base_key, month, month_text):
+        """
+        劇場（・ステージ）と年月ごとのキー（年月が求められない月は表示名）
+        """
+        if month is None:
+            return f"{base_key}|{month_text}"
+        return f"{base_key}|{month[0]}-{month[1]:02d}"
+
+    def reusable_rows(self, key, month):
+        """
+        再取得不要であれば保存済みのレコードを返す
+        month は resolve_months 等で求めた (年, 月)
+        """
+        if not self.enabled:
+            return None
+        entry = self.state.get(key)
+        if entry is None:
+            return None
+        self.used.add(key)
+
+        if month is None:
+            return None
+        today = t.localtime()
+        offset = (month[0] * 12 + month[1]) - (today.tm_year * 12 + today.tm_mon)
+        if offset in (0, 1):
+            return None
+        if offset >= 2 and t.time() - entry['updated_at'] >= self.interval:
+            return None
+        return self.state.lookup(key, entry['fingerprint'])
+
+    def record(self, key, rows):
+        """
+        取得したレコードとそのハッシュ値を保存
+        """
+        if not self.enabled:
+            return
+        self.used.add(key)
+        self.state.store(key, fingerprint(json.dumps(rows, ensure_ascii=False, sort_keys=True)), rows)
+
+    def prune(self, today=None):
+        """
+        今月より前の月（と年月の分からない月）のうち、今回参照しなかったものを削除
+        劇場のページに表示されなくなった月が蓄積し続けないようにする
+        """
+        today = today or t.localtime()
+        current = f"{today.tm_year}-{today.tm_mon:02d}"
+
+        def expired(key, entry):
+            if key in self.used:
+                return False
+            match = re.search(r'\|(\d{4}-\d{2})$', key)
+            return match is None or match.group(1) < current
+
+        return self.state.remove_if(expired)
+
+    def save(self):
+        if self.enabled:
+            self.prune()
+        self.state.save()
@@ -1,39 +1,92 @@
-import time as t
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
 import pandas as pd
 from dotenv import load_dotenv
 import os
 import re
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from browser_session import create_driver
+from http_scraper import HttpClient, NeedsBrowser, parse_reservation_details
+from event_store import EventStore, csv_export_enabled
+from session_cache import SessionCache
 
 load_dotenv()
 
-chromedriver_path = os.getenv('CHROMEDRIVER_PATH')
-
 login_url = "https://ty.funity.jp/ticket/mypage_top/view?clientid=yoshimoto"
 login_id = os.getenv('MYF_LOGIN_ID')
 login_pw = os.getenv('MYF_LOGIN_PW')
 
-def setup_driver_options():
-    options = Options()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.6723.92 Safari/537.36"
-    options.add_argument(f"user-agent={user_agent}")
-    return options
-
-def login():
-    driver = webdriver.Chrome(service=Service(chromedriver_path), options=setup_driver_options())
+# true: 全ページをたどる / false: 全件が保存済みのページに到達した時点で終了
+full_backfill = os.getenv('MYPAGE_FULL_BACKFILL', 'false').lower() == 'true'
+# たどるページ数の上限（0は無制限）
+max_pages = int(os.getenv('MYPAGE_MAX_PAGES') or 0)
+
+# 予約詳細ページを同時に取得する数
+detail_workers = int(os.getenv('MYPAGE_DETAIL_WORKERS', 4))
+
+# 購入履歴の表の全行を1回で取得（予約番号リンクのURLを含む）
+PURCHASE_ROWS_SCRIPT = """
+return Array.from(document.querySelectorAll('table.table-funity tbody tr')).map(function (row) {
+    var cells = Array.from(row.querySelectorAll('td'));
+    var link = cells.length > 1 ? cells[1].querySelector('a') : null;
+    return {
+        cells: cells.map(function (cell) { return cell.innerText.trim(); }),
+        link: link ? link.href : null
+    };
+});
+"""
+
+def is_logged_in(driver, timeout=5):
+    """
+    ログイン中の会員IDが表示されているか
+    """
+    try:
+        member_id = WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.ID, "memberId"))
+        ).text
+    except TimeoutException:
+        return False
+    return member_id == login_id
+
+def restore_session(driver, session_cache):
+    """
+    保存済みのCookieでログイン状態を復元
+    """
+    cookies = session_cache.load()
+    if not cookies:
+        return False
+
+    # Cookieは同じドメインのページを開いてから追加する
+    driver.get(login_url)
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException:
+            pass
+    driver.get(login_url)
+    if is_logged_in(driver):
+        print("Reused saved session.")
+        return True
+
+    print("Saved session has expired.")
+    driver.delete_all_cookies()
+    session_cache.clear()
+    return False
+
+def login(driver=None, session_cache=None):
+    driver = driver or create_driver()
+    session_cache = session_cache or SessionCache(secret=f"{login_id}:{login_pw}")
     try:
+        if restore_session(driver, session_cache):
+            return driver
+
         driver.get(login_url)
 
-        # リダイレクトを待機
-        t.sleep(2)
+        # リダイレクトを待機（ログインフォームの表示まで）
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.NAME, "loginId")))
 
         # ログイン情報を入力
         driver.find_element(By.NAME, "loginId").send_keys(login_id)
@@ -42,23 +95,18 @@ def login():
         # ログインボタンをクリック
         driver.find_element(By.ID, "LoginAction_0").click()
 
-        # ページ遷移の待機
-        t.sleep(1)
-
-        # ログイン成功の確認
-        try:
-            member_id = driver.find_element(By.ID, "memberId").text
-            if member_id == login_id:
-                print("Login successful.")
-                return driver
-            else:
-                print("Login failed: Member ID does not match.")
-                driver.quit()
-                return None
-        except Exception as e:
-            print("Login failed: Member ID not found.")
-            driver.quit()
-            return None
+        # ログイン成功の確認（ページ遷移の待機を兼ねる）
+        if is_logged_in(driver, timeout=10):
+            print("Login successful.")
+            # セッションの保存に失敗してもログイン済みのドライバーはそのまま使う
+            try:
+                session_cache.save(driver.get_cookies())
+            except Exception as e:
+                print(f"Warning: failed to save session cache: {e}")
+            return driver
+        print("Login failed: Member ID not found or does not match.")
+        driver.quit()
+        return None
     except Exception as e:
         print(f"An error occurred during login: {e}")
         driver.quit()
@@ -70,130 +118,201 @@ def split_venue_location(venue):
         return match.group(1), match.group(2)
     return venue, ""
 
+def format_reservation_details(open_time, start_time, pickup_method, ticket_number, total_price):
+    pickup_method = "劇場" if pickup_method == "自動発券機・劇場窓口" else pickup_method
+    return open_time, start_time, pickup_method, ticket_number, total_price.replace(",", "")
+
+def extract_purchase_rows(driver):
+    """
+    表示中のページの購入履歴の行を取得（列が足りない行は除く）
+    """
+    rows = driver.execute_script(PURCHASE_ROWS_SCRIPT)
+    return [row for row in rows if len(row['cells']) >= 12]
+
+def fetch_reservation_details(client, url):
+    """
+    予約詳細ページをHTTPで取得
+    """
+    return format_reservation_details(*parse_reservation_details(client.fetch_document(url)))
+
+def collect_reservation_details(driver, rows):
+    """
+    新規の予約の詳細を取得し、予約番号ごとに返す
+    リンク先のURLがあればログイン中のCookieを使ってHTTPで並列に取得し、
+    取得できなかった予約はリンクをクリックして取得する
+    """
+    details = {}
+    http_rows = [row for row in rows if (row['link'] or '').startswith(('http://', 'https://'))]
+    if http_rows:
+        with HttpClient(pool_size=detail_workers) as client:
+            client.load_cookies(driver.get_cookies())
+            with ThreadPoolExecutor(max_workers=detail_workers) as executor:
+                futures = {
+                    row['cells'][1]: executor.submit(fetch_reservation_details, client, row['link'])
+                    for row in http_rows
+                }
+                for reservation_id, future in futures.items():
+                    try:
+                        details[reservation_id] = future.result()
+                    except (NeedsBrowser, requests.exceptions.RequestException) as e:
+                        print(f"Fetching details for {reservation_id} in the browser: {e}")
+
+    for row in rows:
+        reservation_id = row['cells'][1]
+        if reservation_id not in details:
+            details[reservation_id] = scrape_reservation_details(driver, reservation_id)
+    return details
+
+def build_purchase_record(cells, details):
+    """
+    購入履歴の行と予約詳細から1件分のレコードを作成
+    """
+    reservation_id = cells[1]
+    event_date = cells[5].replace("(", "（").replace(")", "）")
+    event_name = cells[3]
+    venue, location = split_venue_location(cells[4])
+    price = cells[8].replace(",", "").replace("円", "")
+    quantity = cells[9].replace("枚", "")
+    seat_type = cells[6]
+    purchase_date = cells[2].replace("(", "（").replace(")", "）")
+
+    open_time, start_time, pickup_method, ticket_number, total_price = details
+
+    # ソートIDの生成 (int型)
+    sort_id = int(
+        event_date[:4] + event_date[5:7] + event_date[8:10] +  # YYMMDD形式
+        open_time.replace(":", "").zfill(4) +  # HHMM形式
+        reservation_id[-3:]  # 予約番号末尾3桁
+    )
+
+    return {
+        "予約番号": reservation_id,
+        "公演日": event_date,
+        "開場": open_time,
+        "開演": start_time,
+        "公演名": event_name,
+        "会場名": venue,
+        "所在地": location,
+        "合計金額": total_price,
+        "枚数": quantity,
+        "分配": "",
+        "席種": seat_type,
+        "引取方法": pickup_method,
+        "引換票番号": ticket_number,
+        "購入日": purchase_date,
+        "ソートID": sort_id
+    }
+
 def scrape_reservation_details(driver, reservation_id):
     try:
         # 予約番号リンクをクリック
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, f"//a[contains(text(), '{reservation_id}')]"))).click()
+        link = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, f"//a[contains(text(), '{reservation_id}')]")))
+        link.click()
 
-        # ページ遷移の待機
-        t.sleep(1)
+        # ページ遷移の待機（履歴ページが置き換わるまで）
+        WebDriverWait(driver, 10).until(EC.staleness_of(link))
 
         # 詳細情報を取得
         open_time = driver.find_element(By.ID, "lbl_HallOpenTime").text if driver.find_elements(By.ID, "lbl_HallOpenTime") else ""
         start_time = driver.find_element(By.ID, "lbl_ShowStartTime").text if driver.find_elements(By.ID, "lbl_ShowStartTime") else ""
         pickup_method = driver.find_element(By.ID, "lbl_GetMethod").text if driver.find_elements(By.ID, "lbl_GetMethod") else ""
-        pickup_method = "劇場" if pickup_method == "自動発券機・劇場窓口" else pickup_method
         ticket_number = driver.find_element(By.ID, "lbl_Caution2").text if driver.find_elements(By.ID, "lbl_Caution2") else ""
-        total_price = driver.find_element(By.ID, "lbl_TotalMoney").text.replace(",", "") if driver.find_elements(By.ID, "lbl_TotalMoney") else ""
+        total_price = driver.find_element(By.ID, "lbl_TotalMoney").text if driver.find_elements(By.ID, "lbl_TotalMoney") else ""
 
         # 戻るボタンをクリックして履歴ページに戻る
         driver.back()
         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-funity tbody tr")))
 
-        return open_time, start_time, pickup_method, ticket_number, total_price
+        return format_reservation_details(open_time, start_time, pickup_method, ticket_number, total_price)
 
     except Exception as e:
         print(f"An error occurred while fetching details for reservation {reservation_id}: {e}")
         return "", "", "", "", ""
 
-def scrape_purchase_history(driver):
+def load_purchase_store(store, csv_file):
+    """
+    既存CSVの購入履歴をストアへ取り込む
+    ストアが空なら全件を取り込み、そうでなければCSVで手入力した列（分配など）と
+    CSVに手で追加した予約を反映する（CSVを書き出す前に行い、手入力の値を失わないようにする）
+    """
+    if not os.path.exists(csv_file):
+        return
+    if store.count_purchases() == 0:
+        store.upsert_purchases(pd.read_csv(csv_file, encoding="utf-8-sig", dtype={"予約番号": str}))
+        return
+    # CSVを書き出さない設定ではCSVは更新されないため、手入力はストアで行う
+    if not csv_export_enabled():
+        return
+
+    csv_data = pd.read_csv(csv_file, encoding="utf-8-sig", dtype={"予約番号": str, "分配": str})
+    added = csv_data[~csv_data["予約番号"].isin(store.purchase_ids())]
+    if not added.empty:
+        store.upsert_purchases(added)
+    store.update_manual_columns(csv_data)
+
+def scrape_purchase_history(driver, store):
     try:
-        # 既存CSVを事前に読み込み予約番号をセットに格納
+        # 保存済みの予約番号をセットに格納
         csv_file = "purchase_history.csv"
-        if os.path.exists(csv_file):
-            existing_data = pd.read_csv(csv_file, encoding="utf-8-sig", dtype={"予約番号": str})
-            existing_reservation_ids = set(existing_data["予約番号"])
-        else:
-            existing_reservation_ids = set()
+        load_purchase_store(store, csv_file)
+        existing_reservation_ids = store.purchase_ids()
 
         # "購入履歴" ボタンをクリック
         WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.ID, "InitAction_ticketReserve"))).click()
 
-        # ページ遷移の待機
-        t.sleep(1)
-
-        # 履歴ページの確認
-        if "履歴" not in driver.find_element(By.TAG_NAME, "h2").text:
+        # ページ遷移の待機と履歴ページの確認
+        try:
+            WebDriverWait(driver, 10).until(EC.text_to_be_present_in_element((By.TAG_NAME, "h2"), "履歴"))
+        except TimeoutException:
             print("Failed to navigate to purchase history.")
             return
 
         history = []
         current_page = 1
-        max_pages = 2  # 最大ページ数を2ページに制限
 
-        while current_page <= max_pages:
+        while not max_pages or current_page <= max_pages:
             print(f"Scraping page {current_page}...")
 
-            # テーブル行を再取得して処理
-            rows = WebDriverWait(driver, 10).until(
+            # 表の全行を1回で取得し、新規の予約だけを処理
+            WebDriverWait(driver, 10).until(
                 EC.presence_of_all_elements_located((By.CSS_SELECTOR, "table.table-funity tbody tr"))
             )
-
-            for index in range(len(rows)):
+            rows = extract_purchase_rows(driver)
+            new_rows = []
+            for row in rows:
+                reservation_id = row['cells'][1]
+
+                # 既存予約番号と重複する場合スキップ
+                if reservation_id in existing_reservation_ids:
+                    print(f"Skipping: {reservation_id}")
+                    continue
+                new_rows.append(row)
+
+            details = collect_reservation_details(driver, new_rows)
+            for row in new_rows:
+                # 同じ予約を再度処理しないよう取得済みとして記録
+                existing_reservation_ids.add(row['cells'][1])
                 try:
-                    # ページ内のテーブル行を再取得
-                    rows = WebDriverWait(driver, 10).until(
-                        EC.presence_of_all_elements_located((By.CSS_SELECTOR, "table.table-funity tbody tr"))
-                    )
-                    row = rows[index]  # 再取得した行を使用
-
-                    columns = row.find_elements(By.TAG_NAME, "td")
-                    if len(columns) < 12:
-                        continue
-
-                    reservation_id = columns[1].text.strip()
-
-                    # 既存予約番号と重複する場合スキップ
-                    if reservation_id in existing_reservation_ids:
-                        print(f"Skipping: {reservation_id}")
-                        continue
-
-                    event_date = columns[5].text.strip().replace("(", "（").replace(")", "）")
-                    event_name = columns[3].text.strip()
-                    venue, location = split_venue_location(columns[4].text.strip())
-                    price = columns[8].text.strip().replace(",", "").replace("円", "")
-                    quantity = columns[9].text.strip().replace("枚", "")
-                    seat_type = columns[6].text.strip()
-                    purchase_date = columns[2].text.strip().replace("(", "（").replace(")", "）")
-
-                    open_time, start_time, pickup_method, ticket_number, total_price = scrape_reservation_details(driver, reservation_id)
-
-                    # ソートIDの生成 (int型)
-                    sort_id = int(
-                        event_date[:4] + event_date[5:7] + event_date[8:10] +  # YYMMDD形式
-                        open_time.replace(":", "").zfill(4) +  # HHMM形式
-                        reservation_id[-3:]  # 予約番号末尾3桁
-                    )
-
-                    history.append({
-                        "予約番号": reservation_id,
-                        "公演日": event_date,
-                        "開場": open_time,
-                        "開演": start_time,
-                        "公演名": event_name,
-                        "会場名": venue,
-                        "所在地": location,
-                        "合計金額": total_price,
-                        "枚数": quantity,
-                        "分配": "",
-                        "席種": seat_type,
-                        "引取方法": pickup_method,
-                        "引換票番号": ticket_number,
-                        "購入日": purchase_date,
-                        "ソートID": sort_id
-                    })
+                    history.append(build_purchase_record(row['cells'], details[row['cells'][1]]))
                 except Exception as e:
                     print(f"Error processing row: {e}")
 
+            # 新しい順に並んでいるため、全件が保存済みのページより後は取得済み
+            if rows and not new_rows and not full_backfill:
+                print("All reservations on this page are already saved. Stopping.")
+                break
+
             # 次のページへのリンクをクリック
             next_page = driver.find_elements(By.CSS_SELECTOR, "ul.pagenation a")
             next_links = [link for link in next_page if link.text.strip() == str(current_page + 1)]
 
-            if next_links and current_page < max_pages:
+            if next_links and (not max_pages or current_page < max_pages):
+                # 詳細ページとの行き来で表が再描画されている場合があるため、クリック直前に取得し直す
+                first_row = driver.find_element(By.CSS_SELECTOR, "table.table-funity tbody tr")
                 next_links[0].click()
 
-                # ページ遷移の待機
-                t.sleep(2)
+                # ページ遷移の待機（表示中の表が置き換わるまで）
+                WebDriverWait(driver, 10).until(EC.staleness_of(first_row))
 
                 # ページ遷移確認
                 if "履歴" not in driver.find_element(By.TAG_NAME, "h2").text:
@@ -204,25 +323,20 @@ def scrape_purchase_history(driver):
             else:
                 break
 
-        # 新規データをDataFrameに変換してCSVに追加
+        # 新規データをDataFrameに変換してストアに追加
         if history:
             new_data = pd.DataFrame(history)
             # 明示的に文字列型に変換
             new_data["予約番号"] = new_data["予約番号"].astype(str)
             new_data["引換票番号"] = new_data["引換票番号"].astype(str)
 
-            if os.path.exists(csv_file):
-                existing_data = pd.read_csv(csv_file, encoding="utf-8-sig", dtype={"予約番号": str})
-                combined_data = pd.concat([existing_data, new_data]).drop_duplicates(subset=["予約番号"])
-            else:
-                combined_data = new_data
-
-            # ソートIDで降順ソート
-            combined_data.sort_values(by="ソートID", ascending=False, inplace=True)
+            store.upsert_purchases(new_data)
+            print("購入履歴をストアに更新しました。")
 
-            # CSVに保存
-            combined_data.to_csv(csv_file, index=False, encoding="utf-8-sig")
-            print("購入履歴をCSVに更新しました。")
+            # CSVに保存（ソートIDのインデックス順に読み出すため並べ替えは不要）
+            if csv_export_enabled():
+                store.load_purchases().to_csv(csv_file, index=False, encoding="utf-8-sig")
+                print("購入履歴をCSVに更新しました。")
         else:
             print("No new data to add.")
 
@@ -232,5 +346,6 @@ def scrape_purchase_history(driver):
 if __name__ == "__main__":
     driver = login()
     if driver:
-        scrape_purchase_history(driver)
+        with EventStore() as store:
+            scrape_purchase_history(driver, store)
         driver.quit()
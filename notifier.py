@@ -0,0 +1,156 @@
+import os
+import json
+import logging
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class NotificationDispatcher:
+    """
+    1回の実行で発生した通知をまとめ、1本のSMTP接続で送信する
+    ダイジェストモードでは全通知を1通にまとめ、送信できなかった通知は再送キューへ保存して次回送る
+    SMTP_STARTTLS=false・EMAIL_ADDRESS未設定にすればローカルの検証用SMTPサーバーへも送信できる
+    """
+
+    def __init__(self, digest=None, compose_digest=None, queue_path=None, max_attempts=None,
+                 host=None, port=None, starttls=None, username=None, password=None,
+                 sender=None, to_email=None):
+        if digest is None:
+            digest = os.getenv('NOTIFY_DIGEST', 'false').lower() == 'true'
+        if starttls is None:
+            starttls = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+        self.digest = digest
+        # ダイジェストの件名・本文を組み立てる関数 (sections) -> (subject, html_body, text_body)
+        self.compose_digest = compose_digest
+        self.queue_path = queue_path or os.getenv('NOTIFY_RETRY_QUEUE_PATH', 'cache/mail_retry_queue.json')
+        self.max_attempts = int(max_attempts or os.getenv('NOTIFY_MAX_ATTEMPTS', 5))
+        self.host = host or os.getenv('SMTP_SERVER')
+        self.port = int(port or os.getenv('SMTP_PORT', 587))
+        self.starttls = starttls
+        self.username = username if username is not None else os.getenv('EMAIL_ADDRESS')
+        self.password = password if password is not None else os.getenv('EMAIL_PASSWORD')
+        self.sender = sender or os.getenv('SENDER')
+        self.to_email = to_email or os.getenv('TO_EMAIL')
+        self.messages = []
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, subject, html_body, section=None, text_body=None):
+        """
+        通知を追加（送信は flush でまとめて行う）
+        section はダイジェストモードで compose_digest に渡す通知ごとの内容
+        """
+        self.messages.append({
+            'subject': subject, 'html': html_body, 'text': text_body, 'section': section, 'attempts': 0
+        })
+
+    def _load_queue(self):
+        if not os.path.exists(self.queue_path):
+            return []
+        try:
+            with open(self.queue_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"再送キューを読み込めないため破棄します: {e}")
+            return []
+
+    def _save_queue(self, queue):
+        if not queue and not os.path.exists(self.queue_path):
+            return
+        directory = os.path.dirname(self.queue_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.queue_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(queue, file, ensure_ascii=False)
+        os.replace(tmp_path, self.queue_path)
+
+    def _build_digest(self):
+        """
+        今回追加された通知を1通にまとめる
+        """
+        if not self.digest or len(self.messages) <= 1 or self.compose_digest is None:
+            return self.messages
+        subject, html_body, text_body = self.compose_digest([message['section'] for message in self.messages])
+        return [{'subject': subject, 'html': html_body, 'text': text_body, 'section': None, 'attempts': 0}]
+
+    def _build_mime(self, message):
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.sender
+        msg['To'] = self.to_email
+        msg['Subject'] = message['subject']
+        # multipart/alternative は後に置いたパートが優先されるため、テキストを先に添付
+        if message.get('text'):
+            msg.attach(MIMEText(message['text'], 'plain'))
+        msg.attach(MIMEText(message['html'], 'html'))
+        return msg
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def flush(self):
+        """
+        再送キューの通知と今回の通知を1本の接続で送信し、失敗した通知を再送キューへ保存
+        """
+        pending = self._load_queue() + self._build_digest()
+        self.messages = []
+        if not pending:
+            return
+
+        failed = []
+        server = None
+        try:
+            server = self._connect()
+        except Exception as e:
+            logging.error(f"メールサーバーへの接続エラー: {e}")
+            failed = pending
+            pending = []
+
+        for message in pending:
+            try:
+                try:
+                    server.send_message(self._build_mime(message))
+                except smtplib.SMTPServerDisconnected:
+                    # 途中で切断された場合は1回だけ接続し直す
+                    server = self._connect()
+                    server.send_message(self._build_mime(message))
+                self.sent += 1
+                logging.info(f"通知メールが送信されました: {message['subject']}")
+            except Exception as e:
+                logging.error(f"メール送信エラー: {message['subject']}: {e}")
+                failed.append(message)
+
+        if server is not None:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+
+        queue = []
+        for message in failed:
+            message['attempts'] += 1
+            if message['attempts'] >= self.max_attempts:
+                logging.error(f"再送回数の上限に達したため破棄します: {message['subject']}")
+            else:
+                queue.append(message)
+        self._save_queue(queue)
+        if queue:
+            logging.warning(f"{len(queue)}件の通知を再送キューに保存しました: {self.queue_path}")
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import threading
+import time as t
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 取得処理の形式を変えた場合は値を上げて古いキャッシュを無効にする
+CACHE_VERSION = 1
+
+
+def fingerprint(content):
+    """
+    ページ内の対象部分のハッシュ値
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class PageCache:
+    """
+    URL等をキーに、対象部分のハッシュ値と取得結果をファイルへ保存するキャッシュ
+    ハッシュ値が一致した場合は取得処理を省略して保存済みの結果を返す
+    """
+
+    def __init__(self, path=None, enabled=None, max_age_days=None):
+        self.path = path or os.getenv('PAGE_CACHE_PATH', 'cache/page_cache.json')
+        if enabled is None:
+            enabled = os.getenv('PAGE_CACHE', 'true').lower() == 'true'
+        self.enabled = enabled
+        self.max_age = float(max_age_days or os.getenv('PAGE_CACHE_MAX_AGE_DAYS', 30)) * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = self._load() if enabled else {}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"キャッシュを読み込めないため破棄します: {e}")
+            return {}
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def lookup(self, key, page_fingerprint):
+        """
+        ハッシュ値が一致すれば保存済みの取得結果を返す
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['fingerprint'] != page_fingerprint:
+                self.misses += 1
+                return None
+            entry['checked_at'] = t.time()
+            self.hits += 1
+            return entry['records']
+
+    def store(self, key, page_fingerprint, records):
+        if not self.enabled:
+            return
+        now = t.time()
+        with self._lock:
+            self._entries[key] = {
+                'fingerprint': page_fingerprint,
+                'records': records,
+                'updated_at': now,
+                'checked_at': now
+            }
+
+    def remove_if(self, condition):
+        """
+        condition(キー, エントリ) が真を返すエントリを削除し、削除した件数を返す
+        """
+        with self._lock:
+            removed = [key for key, entry in self._entries.items() if condition(key, entry)]
+            for key in removed:
+                del self._entries[key]
+        return len(removed)
+
+    def fetch(self, key, content, extract):
+        """
+        contentのハッシュ値が一致すればキャッシュを、一致しなければextract()の結果を返す
+        """
+        page_fingerprint = fingerprint(content)
+        records = self.lookup(key, page_fingerprint)
+        if records is None:
+            records = extract()
+            self.store(key, page_fingerprint, records)
+        return records
+
+    def save(self):
+        """
+        一定期間参照されていないエントリを削除してファイルへ書き出す
+        """
+        if not self.enabled:
+            return
+        threshold = t.time() - self.max_age
+        with self._lock:
+            self._entries = {
+                key: entry for key, entry in self._entries.items()
+                if entry['checked_at'] >= threshold
+            }
+            data = {'version': CACHE_VERSION, 'entries': self._entries}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 書き込み途中で中断しても壊れないよう一時ファイルから置き換える
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        print(f"キャッシュ: ヒット{self.hits}件 / 取得{self.misses}件")
@@ -0,0 +1,126 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from page_cache import PageCache
+from columnar import blank_to_missing, load_events
+import talent_tickets
+import theater_schedules
+import merge_events
+
+load_dotenv()
+
+
+class StageFailed(Exception):
+    """
+    パイプラインの工程が失敗した（依存する工程は実行しない）
+    """
+
+
+class Pipeline:
+    """
+    工程の依存関係に従い、実行できる工程から並列に実行する
+    各工程には依存する工程の戻り値が、依存関係に指定した順に渡される
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, func, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"工程 {name} の依存先 {dep} が登録されていません")
+        self.stages[name] = (func, tuple(deps))
+
+    def run(self, max_workers=None):
+        """
+        全工程を実行して工程名ごとの戻り値を返す
+        失敗した工程があれば、依存しない工程を実行し終えてから StageFailed を送出
+        """
+        results = {}
+        failed = {}
+        skipped = set()
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.stages) or 1) as executor:
+            while pending or running:
+                for name, (func, deps) in list(pending.items()):
+                    if any(dep in failed or dep in skipped for dep in deps):
+                        logging.warning(f"依存する工程が失敗したため {name} を実行しません")
+                        skipped.add(name)
+                        del pending[name]
+                    elif all(dep in results for dep in deps):
+                        logging.info(f"工程を開始します: {name}")
+                        running[executor.submit(func, *[results[dep] for dep in deps])] = name
+                        del pending[name]
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        logging.info(f"工程が完了しました: {name}")
+                    except Exception as e:
+                        logging.exception(f"工程が失敗しました: {name}")
+                        failed[name] = e
+
+        if failed or skipped:
+            raise StageFailed(f"失敗: {', '.join(failed)} / 未実行: {', '.join(sorted(skipped))}")
+        return results
+
+
+def build_pipeline(talents, theaters, cache, checkpoint=True, reuse_checkpoints=False):
+    """
+    タレント・劇場の取得を並列に行い、両方の完了後に結合、その後に通知する工程
+    CSVは工程の出力のチェックポイントとしてのみ書き出す
+    （取得中はタレント・劇場ごとに追記するため、中断しても続きから再開できる）
+    """
+    def scrape_talents():
+        if reuse_checkpoints:
+            return load_events('talent_tickets.csv', 'talent_tickets.arrow')
+        df = talent_tickets.scrape_talents(talents, cache, checkpoint)
+        # CSVを経由した場合と同じ値で結合するため、空文字は欠損値にする
+        return blank_to_missing(df)
+
+    def scrape_theaters():
+        if reuse_checkpoints:
+            return load_events('theater_schedules.csv', 'theater_schedules.arrow')
+        df = theater_schedules.scrape_theater_schedules(theaters, cache, checkpoint)
+        return blank_to_missing(df)
+
+    def merge(talent_df, theater_df):
+        talent_schedules = merge_events.merge_schedules(talent_df, theater_df, talents)
+        return merge_events.update_schedules(talents, talent_schedules)
+
+    def notify(diffs):
+        merge_events.notify_changes(talents, diffs)
+
+    pipeline = Pipeline()
+    pipeline.add('talents', scrape_talents)
+    pipeline.add('theaters', scrape_theaters)
+    pipeline.add('merge', merge, deps=['talents', 'theaters'])
+    pipeline.add('notify', notify, deps=['merge'])
+    return pipeline
+
+def main():
+    talents = json.loads(os.getenv('TALENTS'))
+    theaters = json.loads(os.getenv('THEATERS'))
+    checkpoint = os.getenv('PIPELINE_CHECKPOINT', 'true').lower() == 'true'
+    reuse_checkpoints = os.getenv('PIPELINE_REUSE_CHECKPOINTS', 'false').lower() == 'true'
+
+    # タレント・劇場の取得で1つのキャッシュを共有し、最後にまとめて保存
+    cache = PageCache()
+    try:
+        build_pipeline(talents, theaters, cache, checkpoint, reuse_checkpoints).run()
+    finally:
+        cache.save()
+        theater_schedules.report_wait_timings()
+
+    logging.info("パイプラインの全工程が完了しました")
+
+if __name__ == "__main__":
+    main()
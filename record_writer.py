@@ -0,0 +1,109 @@
+import os
+import csv
+import json
+import time as t
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RecordWriter:
+    """
+    タレント・劇場などの単位ごとにレコードを作業用ファイル（<path>.partial）へ追記し、完了した単位をチェックポイントに記録する
+    中断後の再実行では、チェックポイント以降に書きかけた行を切り詰め、未完了の単位から再開できる
+    全単位の完了後に作業用ファイルで path を置き換えるため、取得中・中断後も path は前回の完全な結果のまま
+    """
+
+    def __init__(self, path, columns, checkpoint_path=None, resume=None, max_age_hours=None):
+        self.path = path
+        self.partial_path = f"{path}.partial"
+        self.columns = list(columns)
+        self.checkpoint_path = checkpoint_path or os.path.join('cache', f"{os.path.basename(path)}.checkpoint.json")
+        if resume is None:
+            resume = os.getenv('SCRAPER_RESUME', 'true').lower() == 'true'
+        self.max_age = float(max_age_hours or os.getenv('SCRAPER_CHECKPOINT_MAX_AGE_HOURS', 1)) * 3600
+        self.completed = []
+        if not (resume and self._resume()):
+            self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 途中で例外が発生した場合はチェックポイントを残して再開できるようにする
+        if exc_type is None:
+            self.close()
+
+    def _start(self):
+        with open(self.partial_path, 'w', encoding='utf-8-sig', newline='') as file:
+            csv.writer(file, quoting=csv.QUOTE_ALL, lineterminator='\n').writerow(self.columns)
+        self._save_checkpoint()
+
+    def _resume(self):
+        """
+        有効なチェックポイントがあれば、記録時点のファイルサイズまで切り詰めて再開
+        """
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.partial_path):
+            return False
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if (checkpoint.get('columns') != self.columns
+                or t.time() - checkpoint.get('updated_at', 0) > self.max_age
+                or os.path.getsize(self.partial_path) < checkpoint.get('offset', 0)):
+            return False
+
+        with open(self.partial_path, 'r+b') as file:
+            file.truncate(checkpoint['offset'])
+        self.completed = checkpoint['completed']
+        if self.completed:
+            print(f"{self.path}: 前回の続きから再開します（完了済み {len(self.completed)}件）")
+        return True
+
+    def _save_checkpoint(self):
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        checkpoint = {
+            'columns': self.columns,
+            'completed': self.completed,
+            'offset': os.path.getsize(self.partial_path),
+            'updated_at': t.time()
+        }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(checkpoint, file, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def is_completed(self, key):
+        return key in self.completed
+
+    def write(self, key, records):
+        """
+        1単位分のレコードを追記してディスクへ書き出し、完了を記録
+        """
+        with open(self.partial_path, 'a', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL, lineterminator='\n')
+            writer.writerows([record.get(column) for column in self.columns] for record in records)
+            file.flush()
+            os.fsync(file.fileno())
+        self.completed.append(key)
+        self._save_checkpoint()
+
+    def close(self):
+        """
+        全単位の書き込みが完了したので作業用ファイルで path を置き換え、チェックポイントを削除
+        """
+        os.replace(self.partial_path, self.path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def read(self):
+        """
+        書き込んだCSVを読み込む（close() の後に呼び出す）
+        レコードから直接作ったDataFrameと同じく、値は文字列のまま（空欄も空文字）で返す
+        """
+        return pd.read_csv(self.path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
@@ -0,0 +1,71 @@
+import os
+import json
+import base64
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 鍵を導出する際の反復回数
+KDF_ITERATIONS = 390000
+
+
+def derive_key(secret, salt):
+    """
+    パスワード等の文字列からFernetの鍵を導出
+    """
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+    return base64.urlsafe_b64encode(kdf.derive(secret.encode('utf-8')))
+
+
+class SessionCache:
+    """
+    ログイン後のCookieを暗号化してファイルに保存するキャッシュ
+    鍵は SESSION_CACHE_KEY（Fernet鍵）、未設定ならログイン情報から導出する
+    ログイン情報が変わると復号できなくなり、改めてログインする
+    """
+
+    def __init__(self, path=None, key=None, secret=None):
+        self.path = path or os.getenv('SESSION_CACHE_PATH', 'cache/mypage_session.json')
+        self.key = key or os.getenv('SESSION_CACHE_KEY')
+        self.secret = secret
+
+    def _fernet(self, salt):
+        if self.key:
+            return Fernet(self.key)
+        return Fernet(derive_key(self.secret or '', salt))
+
+    def load(self):
+        """
+        保存済みのCookieの一覧（保存されていない・復号できない場合はNone）
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            salt = base64.b64decode(data['salt'])
+            token = self._fernet(salt).decrypt(data['token'].encode('ascii'))
+            return json.loads(token)
+        except (OSError, ValueError, KeyError, InvalidToken) as e:
+            print(f"保存済みのセッションを読み込めません: {e.__class__.__name__}")
+            return None
+
+    def save(self, cookies):
+        salt = os.urandom(16)
+        token = self._fernet(salt).encrypt(json.dumps(cookies).encode('utf-8'))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 書き込み途中で中断しても壊れないよう一時ファイルから置き換える
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'salt': base64.b64encode(salt).decode('ascii'), 'token': token.decode('ascii')}, file)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,76 @@
+from collections import deque
+
+
+class TalentMatcher:
+    """
+    複数のタレント名を同時に検索するAho-Corasickオートマトン
+    文字列1回の走査で、含まれている全タレント名を取得する
+    """
+
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(names))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        self._match_empty = '' in self.names
+        for name in self.names:
+            # 空文字はすべての文字列に含まれるため find で扱う
+            if name:
+                self._add(name)
+        self._build()
+
+    def _add(self, name):
+        state = 0
+        for char in name:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(name)
+
+    def _build(self):
+        # 幅優先で失敗遷移を設定
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find(self, text):
+        """
+        文字列に含まれるタレント名の集合
+        """
+        found = {''} if self._match_empty else set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return found
+
+    def index(self, series):
+        """
+        タレント名ごとに、名前を含む行のインデックスの一覧を返す
+        同じ文字列は1回だけ走査する
+        """
+        rows = {name: [] for name in self.names}
+        matches = {}
+        for idx, text in series.items():
+            if not isinstance(text, str):
+                continue
+            if text not in matches:
+                matches[text] = self.find(text)
+            for name in matches[text]:
+                rows[name].append(idx)
+        return rows
@@ -1,29 +1,78 @@
 import time as t
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
 import pandas as pd
 from dotenv import load_dotenv
 import os
 import json
 import re
-import csv
+import requests
+from browser_session import BrowserSession
+from http_scraper import HttpClient, NeedsBrowser, parse_feed_items, region_html
+from page_cache import PageCache
+from columnar import TALENT_SCHEMA, write_events_arrow
+from record_writer import RecordWriter
 
 load_dotenv()
 
-chromedriver_path = os.getenv('CHROMEDRIVER_PATH')
-
 talent_url = os.getenv('TALENT_BASE_URL')
-talents = json.loads(os.getenv('TALENTS'))
-
 
-def get_ticket_info(talent_id, talent_name):
+FEED_SELECTOR = '#feed_ticket_info2'
+
+# フィード部分のHTML（キャッシュのハッシュ値計算用）
+FEED_REGION_SCRIPT = """
+    const el = document.querySelector('#feed_ticket_info2');
+    return el ? el.outerHTML : '';
+"""
+
+# フィード項目の全フィールドを1回のスクリプト実行でまとめて取得する
+FEED_ITEMS_SCRIPT = """
+    const text = (root, selector) => {
+        const el = root.querySelector(selector);
+        return el ? (el.innerText || '').trim() || '-' : '-';
+    };
+    const attr = (root, selector, name) => {
+        const el = root.querySelector(selector);
+        return el ? el[name] || el.getAttribute(name) || '-' : '-';
+    };
+    return Array.from(document.querySelectorAll('#feed_ticket_info2 .feed-item-container')).map(event => ({
+        title: text(event, '.feed-ticket-title'),
+        date: text(event, '.opt-feed-ft-dateside p:first-child'),
+        time: text(event, '.opt-feed-ft-dateside p:last-child'),
+        members: text(event, '.opt-feed-ft-element-member'),
+        venue: text(event, '.opt-feed-ft-element-venue'),
+        image: attr(event, '.feed-item-img', 'src'),
+        link: attr(event, '.feed-item-link', 'href')
+    }));
+"""
+
+extraction_mode = os.getenv('EXTRACTION_MODE', 'script')
+scraper_engine = os.getenv('SCRAPER_ENGINE', 'browser')
+
+
+def get_ticket_info(session, talent_id, talent_name, client=None, cache=None):
     print(f"{talent_id}: {talent_name} の情報を取得しています")
     url = f"{talent_url}{talent_id}"
-    driver = webdriver.Chrome(service=Service(chromedriver_path), options=setup_driver_options())
-    driver.get(url)
-
+    if cache is None:
+        cache = PageCache(enabled=False)
+
+    # HTTPで取得できるページはブラウザを使わない
+    if client:
+        try:
+            document = client.fetch_document(url)
+            # フィード部分が前回と同じなら解析を省略
+            items = cache.fetch(url, region_html(document, FEED_SELECTOR), lambda: parse_feed_items(document))
+            return [build_event_record(talent_id, talent_name, item) for item in items]
+        except (NeedsBrowser, requests.RequestException) as e:
+            print(f"HTTPでの取得に失敗したためブラウザで取得します: {e}")
+
+    items = session.visit(url, lambda driver: cache.fetch(url, get_feed_region(driver), lambda: extract_feed_items(driver)))
+    return [build_event_record(talent_id, talent_name, item) for item in items]
+
+def get_feed_region(driver):
+    return driver.execute_script(FEED_REGION_SCRIPT)
+
+def extract_feed_items(driver):
     # 隠れている要素を表示するJavaScriptの実行
     driver.execute_script("""
         document.querySelectorAll('[id^="feedItem2-"]').forEach(el => {
@@ -31,40 +80,60 @@ def get_ticket_info(talent_id, talent_name):
         });
     """)
 
-    events = []
-    for event in driver.find_elements(By.CSS_SELECTOR, '#feed_ticket_info2 .feed-item-container'):
-        title = get_element_text(event, '.feed-ticket-title')
-        date = format_date(get_element_text(event, '.opt-feed-ft-dateside p:first-child'))
-        time = get_element_text(event, '.opt-feed-ft-dateside p:last-child')
-        members = clean_text(get_element_text(event, '.opt-feed-ft-element-member').replace('\n', '|'))
-        venue = get_element_text(event, '.opt-feed-ft-element-venue')
-        image = get_element_attribute(event, '.feed-item-img', 'src')
-        link = get_element_attribute(event, '.feed-item-link', 'href')
-
-        events.append({
-            'TalentName': talent_name,
-            'TalentID': talent_id,
-            'Title': title,
-            'Date': date,
-            'StartTime': time,
-            'Members': members,
-            'Venue': venue,
-            'Image': image,
-            'Link': link
-        })
+    items = None
+    if extraction_mode == 'script':
+        items = extract_feed_items_by_script(driver)
+    if items is None:
+        items = extract_feed_items_by_element(driver)
 
-    driver.quit()
-    return events
+    return items
 
-def setup_driver_options():
-    options = Options()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    # User-Agentの設定
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.6723.92 Safari/537.36"
-    options.add_argument(f"user-agent={user_agent}")
-    return options
+def extract_feed_items_by_script(driver):
+    """
+    フィード項目をexecute_script1回で取得
+    失敗した場合はNoneを返し、要素ごとの取得にフォールバックさせる
+    """
+    try:
+        items = driver.execute_script(FEED_ITEMS_SCRIPT)
+    except WebDriverException as e:
+        print(f"スクリプトでの取得に失敗したため要素ごとに取得します: {e}")
+        return None
+    if not isinstance(items, list):
+        return None
+    return items
+
+def extract_feed_items_by_element(driver):
+    """
+    フィード項目を要素ごとに取得
+    """
+    items = []
+    for event in driver.find_elements(By.CSS_SELECTOR, '#feed_ticket_info2 .feed-item-container'):
+        items.append({
+            'title': get_element_text(event, '.feed-ticket-title'),
+            'date': get_element_text(event, '.opt-feed-ft-dateside p:first-child'),
+            'time': get_element_text(event, '.opt-feed-ft-dateside p:last-child'),
+            'members': get_element_text(event, '.opt-feed-ft-element-member'),
+            'venue': get_element_text(event, '.opt-feed-ft-element-venue'),
+            'image': get_element_attribute(event, '.feed-item-img', 'src'),
+            'link': get_element_attribute(event, '.feed-item-link', 'href')
+        })
+    return items
+
+def build_event_record(talent_id, talent_name, item):
+    """
+    取得したフィード項目をCSVのレコード形式に変換
+    """
+    return {
+        'TalentName': talent_name,
+        'TalentID': talent_id,
+        'Title': item['title'],
+        'Date': format_date(item['date']),
+        'StartTime': item['time'],
+        'Members': clean_text(item['members'].replace('\n', '|')),
+        'Venue': item['venue'],
+        'Image': item['image'],
+        'Link': item['link']
+    }
 
 def get_element_text(element, selector):
     try:
@@ -100,13 +169,50 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-all_events = []
-for talent in talents:
-    events = get_ticket_info(talent['id'], talent['name'])
-    all_events.extend(events)
+def iter_talent_events(talents, cache, skip=None):
+    """
+    タレントごとに (タレントID, レコードの一覧) を順に返す
+    skip(タレントID) が真を返すタレントは取得しない
+    """
+    # 全タレントで1つのブラウザを使い回す（ブラウザは必要になった時点で起動）
+    with BrowserSession() as session, HttpClient() as client:
+        for talent in talents:
+            key = str(talent['id'])
+            if skip and skip(key):
+                continue
+            yield key, get_ticket_info(session, talent['id'], talent['name'],
+                                       client if scraper_engine == 'http' else None, cache)
+
+def scrape_talents(talents, cache=None, checkpoint=True):
+    """
+    全タレントの公演情報を取得してDataFrameで返す
+    checkpoint が真ならタレントごとにCSVへ追記し、中断した場合は次回その続きから取得する
+    cache を指定しない場合はここで作成・保存する
+    """
+    own_cache = cache is None
+    cache = cache or PageCache()
+    try:
+        if not checkpoint:
+            return pd.DataFrame([event for _, events in iter_talent_events(talents, cache) for event in events])
+
+        with RecordWriter('talent_tickets.csv', TALENT_SCHEMA.names) as writer:
+            for key, events in iter_talent_events(talents, cache, writer.is_completed):
+                writer.write(key, events)
+        df = writer.read()
+        write_events_arrow(df, 'talent_tickets.arrow', TALENT_SCHEMA, source='talent_tickets.csv')
+        return df
+    finally:
+        if own_cache:
+            cache.save()
+
+def main():
+    talents = json.loads(os.getenv('TALENTS'))
+
+    # タレントごとにCSVへ保存
+    scrape_talents(talents)
+
+    print("公演情報の取得が完了し、CSVファイルに保存しました。")
 
-# データをCSVに保存
-df = pd.DataFrame(all_events)
-df.to_csv('talent_tickets.csv', index=False, encoding='utf-8-sig', quoting=csv.QUOTE_ALL)
+if __name__ == "__main__":
+    main()
 
-print("公演情報の取得が完了し、CSVファイルに保存しました。")
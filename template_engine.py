@@ -0,0 +1,58 @@
+import re
+import html
+from functools import lru_cache
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(.+?)\s*\}\}')
+
+
+class Raw(str):
+    """
+    エスケープせずにそのまま埋め込む値（HTML断片など）
+    """
+
+
+class Template:
+    """
+    {{名前}} 形式のテンプレートを固定文字列と差し込み位置に分割したもの
+    autoescape が有効な場合、Raw 以外の値はHTMLエスケープして埋め込む
+    """
+
+    def __init__(self, source, autoescape=True):
+        parts = PLACEHOLDER_PATTERN.split(source)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+        self.autoescape = autoescape
+
+    def _value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, Raw) or not self.autoescape:
+            return str(value)
+        return html.escape(str(value))
+
+    def render(self, values):
+        """
+        値の辞書を埋め込んだ文字列（存在しない名前は空文字）
+        """
+        chunks = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            chunks.append(self._value(values.get(name)))
+            chunks.append(literal)
+        return ''.join(chunks)
+
+    def render_rows(self, rows, separator=''):
+        """
+        行の一覧（DataFrame.to_dict('records') 等）をまとめて埋め込み、連結した文字列
+        """
+        return separator.join(self.render(row) for row in rows)
+
+
+@lru_cache(maxsize=None)
+def load_template(template_path):
+    """
+    テンプレートファイルを読み込んで分割（プロセス内で1回だけ）
+    .html はHTMLエスケープ、それ以外はそのまま埋め込む
+    """
+    with open(template_path, 'r', encoding='utf-8') as file:
+        source = file.read()
+    return Template(source, autoescape=template_path.endswith('.html'))
@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+from calculate_monthly_totals import rollup_monthly_totals, scan_monthly_totals
+from event_store import EventStore, ROLLUP_DIMENSIONS
+
+
+def purchase(reservation_id, event_date, purchase_date, total, quantity,
+             venue='劇場A', seat_type='指定席', pickup_method='劇場'):
+    return {
+        '予約番号': reservation_id, '公演日': event_date, '開場': '18:30', '開演': '19:00',
+        '公演名': f'公演{reservation_id}', '会場名': venue, '所在地': '東京', '合計金額': total,
+        '枚数': quantity, '分配': None, '席種': seat_type, '引取方法': pickup_method,
+        '引換票番号': '', '購入日': purchase_date, 'ソートID': int(reservation_id),
+    }
+
+
+PURCHASES = [
+    purchase('1', '2024年05月10日（金）', '2024年04月20日（土）', 3000, 1),
+    purchase('2', '2024年05月18日（土）', '2024年05月01日（水）', 7000, 2, venue='劇場B'),
+    purchase('3', '2024年06月01日（土）', '2024年05月01日（水）', 4500, 1, seat_type='自由席'),
+    purchase('4', '2024年06月15日（土）', '2024年06月02日（日）', 9000, 3, pickup_method='コンビニ'),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with EventStore(str(tmp_path / 'events.db')) as store:
+        store.upsert_purchases(pd.DataFrame(PURCHASES))
+        yield store
+
+
+def assert_matches_full_scan(store):
+    """
+    差分で更新した月別集計が、購入履歴全体を集計し直した結果と一致すること
+    """
+    purchases = store.load_purchases()
+    for dimension in [None] + ROLLUP_DIMENSIONS:
+        expected = scan_monthly_totals(purchases, dimension)
+        actual = rollup_monthly_totals(store, dimension)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_insert(store):
+    assert_matches_full_scan(store)
+
+    store.upsert_purchases(pd.DataFrame([
+        purchase('5', '2024年07月01日（月）', '2024年06月10日（月）', 5000, 2, venue='劇場C'),
+    ]))
+    assert_matches_full_scan(store)
+
+
+def test_update_moves_totals_between_months_and_values(store):
+    # 金額・枚数に加えて公演日・購入日・会場名を変更
+    store.upsert_purchases(pd.DataFrame([
+        purchase('2', '2024年07月05日（金）', '2024年06月20日（木）', 8000, 3, venue='劇場C'),
+    ]))
+    assert_matches_full_scan(store)
+
+    # 変更のない再取得では集計は変わらない
+    before = store.load_rollups()
+    store.upsert_purchases(pd.DataFrame(PURCHASES[:1]))
+    pd.testing.assert_frame_equal(store.load_rollups(), before)
+
+
+def test_delete(store):
+    store.delete_purchases(['3', '4'])
+    assert store.purchase_ids() == {'1', '2'}
+    assert_matches_full_scan(store)
+    # 予約がなくなった月の行は残らない
+    assert '2024年06月' not in set(store.load_rollups()['年月'])
+
+
+def test_update_rollups_picks_up_rows_changed_outside_the_store_methods(store):
+    with store.conn:
+        store.conn.execute("DELETE FROM purchases WHERE 予約番号 = '1'")
+    store.update_rollups()
+    assert_matches_full_scan(store)
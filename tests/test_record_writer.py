@@ -0,0 +1,98 @@
+import json
+import os
+import pandas as pd
+import pytest
+from record_writer import RecordWriter
+
+COLUMNS = ['Venue', 'Title', 'Date']
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'schedules.csv'), str(tmp_path / 'schedules.checkpoint.json')
+
+
+def records(venue, count):
+    return [{'Venue': venue, 'Title': f'{venue}公演{i}', 'Date': ''} for i in range(count)]
+
+
+def interrupted_run(csv_path, checkpoint_path):
+    """
+    1単位目を書き込んだ後、2単位目の途中で中断した状態を作る
+    """
+    writer = RecordWriter(csv_path, COLUMNS, checkpoint_path=checkpoint_path, resume=False)
+    writer.write('劇場A', records('劇場A', 2))
+    with open(checkpoint_path, 'r', encoding='utf-8') as file:
+        offset = json.load(file)['offset']
+    with open(writer.partial_path, 'a', encoding='utf-8', newline='') as file:
+        file.write('"劇場B","劇場B公演0",""\n"劇場B","劇場')
+    return offset
+
+
+def test_resume_truncates_partial_unit(paths):
+    csv_path, checkpoint_path = paths
+    offset = interrupted_run(csv_path, checkpoint_path)
+    partial_path = f"{csv_path}.partial"
+    assert os.path.getsize(partial_path) > offset
+
+    with RecordWriter(csv_path, COLUMNS, checkpoint_path=checkpoint_path, resume=True) as writer:
+        # 書きかけの行はチェックポイントの位置まで切り詰められる
+        assert os.path.getsize(partial_path) == offset
+        assert writer.is_completed('劇場A')
+        assert not writer.is_completed('劇場B')
+        writer.write('劇場B', records('劇場B', 3))
+    df = writer.read()
+
+    expected = pd.DataFrame(records('劇場A', 2) + records('劇場B', 3))
+    pd.testing.assert_frame_equal(df, expected)
+    # 正常に完了したら作業用ファイルで置き換わり、チェックポイントは削除される
+    assert not os.path.exists(partial_path)
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_previous_output_is_kept_until_all_units_finish(paths):
+    csv_path, checkpoint_path = paths
+    previous = pd.DataFrame(records('劇場Z', 1))
+    previous.to_csv(csv_path, index=False, encoding='utf-8-sig')
+
+    # 取得中・中断後は前回の完全な結果のまま
+    interrupted_run(csv_path, checkpoint_path)
+    pd.testing.assert_frame_equal(pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig'),
+                                  previous)
+
+    with pytest.raises(RuntimeError):
+        with RecordWriter(csv_path, COLUMNS, checkpoint_path=checkpoint_path, resume=True) as writer:
+            writer.write('劇場B', records('劇場B', 1))
+            raise RuntimeError('中断')
+    pd.testing.assert_frame_equal(pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig'),
+                                  previous)
+
+
+def test_read_matches_in_memory_frame(paths):
+    csv_path, checkpoint_path = paths
+    rows = [{'Venue': '劇場A', 'Title': '0123', 'Date': ''}, {'Venue': '劇場A', 'Title': 'NA', 'Date': '2024-05-01'}]
+    with RecordWriter(csv_path, COLUMNS, checkpoint_path=checkpoint_path, resume=False) as writer:
+        writer.write('劇場A', rows)
+    pd.testing.assert_frame_equal(writer.read(), pd.DataFrame(rows))
+
+
+@pytest.mark.parametrize('options', [
+    {'resume': False},
+    {'resume': True, 'max_age_hours': 1e-9},
+])
+def test_starts_over_without_valid_checkpoint(paths, options):
+    csv_path, checkpoint_path = paths
+    interrupted_run(csv_path, checkpoint_path)
+
+    with RecordWriter(csv_path, COLUMNS, checkpoint_path=checkpoint_path, **options) as writer:
+        assert not writer.is_completed('劇場A')
+        writer.write('劇場B', records('劇場B', 1))
+    pd.testing.assert_frame_equal(writer.read(), pd.DataFrame(records('劇場B', 1)))
+
+
+def test_changed_columns_start_over(paths):
+    csv_path, checkpoint_path = paths
+    interrupted_run(csv_path, checkpoint_path)
+
+    with RecordWriter(csv_path, COLUMNS + ['Link'], checkpoint_path=checkpoint_path, resume=True) as writer:
+        assert writer.completed == []
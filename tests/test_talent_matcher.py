@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+from talent_matcher import TalentMatcher
+
+
+def contains_index(series, names, regex=True):
+    """
+    従来の str.contains による行の抽出結果
+    """
+    return {name: list(series[series.str.contains(name, na=False, regex=regex)].index) for name in names}
+
+
+MEMBERS = pd.Series([
+    'タレントA／タレントAB／芸人C',
+    'タレントAB',
+    'ABCタレント',
+    'ネタ',
+    None,
+    '',
+    'タレントタレントA',
+    '芸人C|タレントB',
+    'アアアアア',
+], index=[10, 11, 12, 13, 14, 15, 16, 17, 18])
+
+
+@pytest.mark.parametrize('names', [
+    # 他の名前の部分文字列になっている名前
+    ['タレントA', 'タレントAB', 'タレント'],
+    # 名前同士が重なって出現する
+    ['アア', 'アアア', 'ア'],
+    # 接頭辞・接尾辞を共有する名前
+    ['タレントB', 'ントB', 'B', 'ABC'],
+    ['芸人C', 'ネタ', '存在しない名前'],
+])
+def test_index_matches_str_contains(names):
+    assert TalentMatcher(names).index(MEMBERS) == contains_index(MEMBERS, names)
+
+
+def test_overlapping_occurrences_are_all_found():
+    matcher = TalentMatcher(['he', 'she', 'his', 'hers'])
+    assert matcher.find('ushers') == {'he', 'she', 'hers'}
+    assert matcher.find('ahishers') == {'he', 'she', 'his', 'hers'}
+
+
+def test_duplicate_names_are_indexed_once():
+    matcher = TalentMatcher(['タレントA', 'タレントA'])
+    assert matcher.index(MEMBERS) == contains_index(MEMBERS, ['タレントA'])
+
+
+def test_empty_name_matches_every_string_row():
+    assert TalentMatcher(['']).index(MEMBERS) == contains_index(MEMBERS, [''])
+
+
+def test_names_are_matched_literally():
+    # str.contains は正規表現として扱っていたため、記号を含む名前は regex=False の結果と一致する
+    members = pd.Series(['コンビ(仮)／芸人C', 'コンビ仮', 'A.B', 'AxB'])
+    names = ['コンビ(仮)', 'A.B']
+    assert TalentMatcher(names).index(members) == contains_index(members, names, regex=False)
@@ -0,0 +1,60 @@
+import pandas as pd
+from template_engine import Raw, Template, load_template
+import merge_events
+
+
+def test_values_are_html_escaped():
+    template = Template('<a href="{{url}}" title=\'{{title}}\'>{{text}}</a>')
+    rendered = template.render({
+        'url': 'https://example.com/?a=1&b="2"',
+        'title': "It's <b>",
+        'text': '<script>alert("x")</script> & more'
+    })
+    assert rendered == (
+        '<a href="https://example.com/?a=1&amp;b=&quot;2&quot;" title=\'It&#x27;s &lt;b&gt;\'>'
+        '&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt; &amp; more</a>'
+    )
+
+
+def test_raw_values_are_not_escaped():
+    template = Template('<div>{{body}}</div>')
+    assert template.render({'body': Raw('<p>a &amp; b</p>')}) == '<div><p>a &amp; b</p></div>'
+
+
+def test_autoescape_disabled_keeps_text():
+    assert Template('{{x}}', autoescape=False).render({'x': '<&"\'>'}) == '<&"\'>'
+
+
+def test_missing_and_none_values_render_empty():
+    template = Template('[{{ a }}][{{b}}]')
+    assert template.render({'a': None}) == '[][]'
+
+
+def test_render_rows_joins_with_separator():
+    template = Template('{{n}}')
+    assert template.render_rows([{'n': 1}, {'n': '<2>'}], ', ') == '1, &lt;2&gt;'
+
+
+def test_template_files_escape_by_extension():
+    assert load_template('email/event_details.html').autoescape
+    assert not load_template('email/new_events.txt').autoescape
+
+
+def test_event_details_escape_scraped_values():
+    diff = pd.DataFrame([{
+        '公演日': '2026-11-01', 'タイトル': '<b>ライブ</b> & "トーク"', '会場': "O'Hall", '開場': '18:30',
+        '開演': '19:00', '終演': '21:00', '出演者': 'A&B', '詳細': '<script>x</script> 2行目',
+        'チケット': 'https://example.com/?a=1&b=2', '画像': "https://example.com/a'.jpg", 'フラグ': 'flag-new'
+    }])
+    event_html, event_text = merge_events.render_event_details(diff)
+
+    assert '&lt;b&gt;ライブ&lt;/b&gt; &amp; &quot;トーク&quot;' in event_html
+    assert 'O&#x27;Hall' in event_html
+    assert 'A&amp;B' in event_html
+    # 詳細はエスケープしてから空白を改行タグに置き換える
+    assert '&lt;script&gt;x&lt;/script&gt;<br>2行目' in event_html
+    assert 'href="https://example.com/?a=1&amp;b=2"' in event_html
+    assert "src='https://example.com/a&#x27;.jpg'" in event_html
+    assert '<script>' not in event_html
+    # テキスト版はエスケープしない
+    assert '<b>ライブ</b> & "トーク"' in event_text
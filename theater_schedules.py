@@ -1,26 +1,112 @@
 import time as t
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 import pandas as pd
 from dotenv import load_dotenv
 import os
 import json
 import re
-import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from browser_session import BrowserPool, BrowserSession
+from http_scraper import HttpClient, NeedsBrowser, parse_schedule_blocks, region_html
+from page_cache import PageCache
+from month_window import MonthWindow, MonthSequence, resolve_months
+from record_writer import RecordWriter
+from columnar import THEATER_SCHEMA, write_events_arrow
 
 load_dotenv()
 
-chromedriver_path = os.getenv('CHROMEDRIVER_PATH')
+# 表示中の月の全スケジュールブロックを1回のスクリプト実行でまとめて取得する
+SCHEDULE_BLOCKS_SCRIPT = """
+    const text = (root, selector) => {
+        const el = root.querySelector(selector);
+        return el ? (el.innerText || '').trim() || '-' : '-';
+    };
+    const attr = (root, selector, name) => {
+        const el = root.querySelector(selector);
+        return el ? el[name] || el.getAttribute(name) || '-' : '-';
+    };
+    return Array.from(document.querySelectorAll('.schedule-block')).map(block => {
+        const times = block.querySelectorAll('.schedule-time');
+        const details = block.querySelectorAll('.schedule-detail');
+        const entries = [];
+        for (let i = 0; i < Math.min(times.length, details.length); i++) {
+            const member = details[i].querySelector('dd.schedule-detail-member');
+            entries.push({
+                title: text(times[i], 'strong'),
+                times: text(times[i], 'span'),
+                members: member ? member.innerText : null,
+                detail: text(details[i], 'dl:nth-of-type(3) dd'),
+                link: attr(details[i], '.btns a:not(.is-pink)', 'href')
+            });
+        }
+        return {id: block.id, entries: entries};
+    });
+"""
+
+# スケジュール部分のDOMが書き換わったかを判定するための署名
+SCHEDULE_SIGNATURE_SCRIPT = """
+    const blocks = document.querySelectorAll('.schedule-block');
+    return blocks.length + '|' + Array.from(blocks).map(b => b.id + ':' + b.textContent.length).join(',');
+"""
+
+# リンク（またはその親要素）が表示中の月・ステージを示す状態か
+ACTIVE_LINK_SCRIPT = """
+    return [arguments[0], arguments[0].parentElement].some(el => el && (
+        (el.getAttribute('aria-current') || 'false') !== 'false'
+        || /(^|\\s)(is-)?(active|current|selected)(\\s|$)/.test(el.getAttribute('class') || '')
+    ));
+"""
+
+# 表示中のスケジュールブロックのID（'schedule2026-11-01' 等。表示中の月の判定用）
+SCHEDULE_IDS_SCRIPT = """
+    return Array.from(document.querySelectorAll('.schedule-block')).map(b => b.id);
+"""
+
+# スケジュール部分のHTML（キャッシュのハッシュ値計算用）
+SCHEDULE_REGION_SCRIPT = """
+    return Array.from(document.querySelectorAll('.schedule-block')).map(b => b.outerHTML).join('');
+"""
+
+# ページの読み込み完了を判定する
+PAGE_READY_SCRIPT = """
+    return document.readyState === 'complete'
+        && document.querySelectorAll('.calendar-month a, .schedule-block').length > 0;
+"""
+
+extraction_mode = os.getenv('EXTRACTION_MODE', 'script')
+scraper_engine = os.getenv('SCRAPER_ENGINE', 'browser')
+
+# 待機の上限秒数（従来の固定待機と同じ2秒を既定とする）
+wait_timeout = float(os.getenv('SCHEDULE_WAIT_TIMEOUT', 2))
+
+# 待機ごとの実測時間
+wait_timings = []
+
+# 並列実行時の同一ホストへの同時接続数
+host_concurrency = int(os.getenv('THEATER_HOST_CONCURRENCY', 2))
 
-theaters = json.loads(os.getenv('THEATERS'))
+def get_schedule_info(session, venue_name, url, stages=None, client=None, cache=None, month_window=None):
+    if cache is None:
+        cache = PageCache(enabled=False)
+    if month_window is None:
+        month_window = MonthWindow(enabled=False)
 
-def get_schedule_info(venue_name, url, stages=None):
-    driver = webdriver.Chrome(service=Service(chromedriver_path), options=setup_driver_options())
-    driver.get(url)
+    # HTTPで取得できるページはブラウザを使わない
+    if client:
+        try:
+            return fetch_schedule_info(client, venue_name, url, stages, cache, month_window)
+        except (NeedsBrowser, requests.RequestException) as e:
+            print(f"HTTPでの取得に失敗したためブラウザで取得します: {e}")
 
-    t.sleep(2)
+    return session.visit(url, lambda driver: extract_schedule_info(driver, venue_name, url, stages, cache, month_window))
+
+def extract_schedule_info(driver, venue_name, url, stages=None, cache=None, month_window=None):
+    wait_until(driver, lambda d: d.execute_script(PAGE_READY_SCRIPT), 'page', venue_name)
     # クッキーバナーを非表示
     driver.execute_script("""
         let banner = document.querySelector('.cookie-consent');
@@ -34,22 +120,71 @@ def get_schedule_info(venue_name, url, stages=None):
     if stages:
         for stage in stages:
             switch_stage(driver, stage)
-            events.extend(retrieve_monthly_schedules(driver, venue_name + f"　{stage}"))
+            events.extend(retrieve_monthly_schedules(driver, venue_name + f"　{stage}", cache, f"{url}|{stage}", month_window))
     else:
-        events.extend(retrieve_monthly_schedules(driver, venue_name))
+        events.extend(retrieve_monthly_schedules(driver, venue_name, cache, url, month_window))
+
+    return events
+
+def fetch_schedule_info(client, venue_name, url, stages=None, cache=None, month_window=None):
+    """
+    ブラウザを使わずHTTPでスケジュールを取得
+    """
+    # ステージごとに月リンクの表示順から年を補う
+    sequences = {}
+    months = {}
+    def month_key(stage, month_text):
+        base_key = f"{url}|{stage}" if stage else url
+        return month_window.key(base_key, months[(stage, month_text)], month_text)
+
+    # 再取得不要な月の保存済みレコード
+    reused = {}
+    def skip(stage, month_text):
+        month = sequences.setdefault(stage, MonthSequence()).resolve(month_text)
+        months[(stage, month_text)] = month
+        rows = month_window.reusable_rows(month_key(stage, month_text), month)
+        if rows is not None:
+            reused[(stage, month_text)] = rows
+        return rows is not None
 
-    driver.quit()
+    events = []
+    for stage, month_text, document in client.fetch_schedule_pages(url, stages, skip):
+        # Venueの表記ゆれを変換
+        stage_venue_name = convert_venue_name(venue_name + f"　{stage}" if stage else venue_name)
+        if document is None:
+            print(f"Reusing schedule for {month_text} at {stage_venue_name}.")
+            events.extend(reused[(stage, month_text)])
+            continue
+
+        print(f"Retrieving schedule for {month_text} at {stage_venue_name}.")
+        key = month_key(stage, month_text)
+        # スケジュール部分が前回と同じなら解析を省略
+        blocks = cache.fetch(key, region_html(document, '.schedule-block'),
+                             lambda: parse_schedule_blocks(document))
+        rows = build_schedule_records(stage_venue_name, blocks)
+        month_window.record(key, rows)
+        events.extend(rows)
     return events
 
 def switch_stage(driver, stage):
     try:
         stage_button = driver.find_element(By.XPATH, f'//a[text()="{stage}"]')
+        # 表示中のステージはクリックしてもDOMが変わらないため待機しない
+        if is_displayed(driver, stage_button):
+            return
+        signature = get_schedule_signature(driver)
         stage_button.click()
-        t.sleep(2)
+        wait_for_schedule_change(driver, signature, 'stage', stage)
     except Exception as e:
         print(f"Failed to switch to Stage {stage}: {e}")
 
-def retrieve_monthly_schedules(driver, venue_name):
+def retrieve_monthly_schedules(driver, venue_name, cache=None, cache_key=None, month_window=None):
+    if cache is None:
+        cache = PageCache(enabled=False)
+    if month_window is None:
+        month_window = MonthWindow(enabled=False)
+    cache_key = cache_key or venue_name
+
     events = []
     # 各月のリンクをクリックしてスケジュールを取得
     month_links = driver.find_elements(By.CSS_SELECTOR, '.calendar-month a')
@@ -57,49 +192,191 @@ def retrieve_monthly_schedules(driver, venue_name):
     # Venueの表記ゆれを変換
     venue_name = convert_venue_name(venue_name)
 
-    for month_link in month_links:
-        month_link.click()
-        print(f"Retrieving schedule for {month_link.text} at {venue_name}.")
-        t.sleep(2)
+    # 年の表記がない月は表示順から年を補う
+    month_texts = [month_link.text for month_link in month_links]
+    for month_link, month_text, month in zip(month_links, month_texts, resolve_months(month_texts)):
+        key = month_window.key(cache_key, month, month_text)
 
-        # すべての詳細を表示する
-        driver.execute_script("""
-            document.querySelectorAll('.schedule-detail').forEach(el => {
-                el.style.display = 'block';
-            });
-        """)
-
-        schedule_blocks = driver.find_elements(By.CSS_SELECTOR, '.schedule-block')
-        for block in schedule_blocks:
-            date = block.get_attribute('id').replace('schedule', '')
-            schedule_times = block.find_elements(By.CSS_SELECTOR, '.schedule-time')
-            schedule_details = block.find_elements(By.CSS_SELECTOR, '.schedule-detail')
-
-            for time_block, detail_block in zip(schedule_times, schedule_details):
-                title = get_element_text(time_block, 'strong')
-                # 除外公演
-                if any(keyword in title for keyword in ['休館日', '貸切']):
-                    continue
-
-                times = get_element_text(time_block, 'span').split('｜')
-                open_time, start_time, end_time = parse_times(times)
-                members = get_members(detail_block)
-                detail = clean_text(get_element_text(detail_block, 'dl:nth-of-type(3) dd'))
-                link = get_element_attribute(detail_block, '.btns a:not(.is-pink)', 'href')
-
-                events.append({
-                    'Venue': venue_name,
-                    'Title': title,
-                    'Date': date,
-                    'OpenTime': open_time,
-                    'StartTime': start_time,
-                    'EndTime': end_time,
-                    'Members': members,
-                    'Detail': detail,
-                    'Link': link
-                })
+        # 再取得不要な月はクリックせず保存済みのレコードを使う
+        rows = month_window.reusable_rows(key, month)
+        if rows is not None:
+            print(f"Reusing schedule for {month_text} at {venue_name}.")
+            events.extend(rows)
+            continue
+
+        print(f"Retrieving schedule for {month_text} at {venue_name}.")
+        # 表示中の月（通常は先頭の月）はクリックしてもDOMが変わらないため待機しない
+        if not is_displayed(driver, month_link, month):
+            signature = get_schedule_signature(driver)
+            month_link.click()
+            wait_for_schedule_change(driver, signature, 'month', f"{venue_name} {month_text}")
+
+        # スケジュール部分が前回と同じなら取得を省略
+        blocks = cache.fetch(key, driver.execute_script(SCHEDULE_REGION_SCRIPT),
+                             lambda: extract_schedule_blocks(driver))
+        rows = build_schedule_records(venue_name, blocks)
+        month_window.record(key, rows)
+        events.extend(rows)
+    return events
+
+def extract_schedule_blocks(driver):
+    # すべての詳細を表示する
+    driver.execute_script("""
+        document.querySelectorAll('.schedule-detail').forEach(el => {
+            el.style.display = 'block';
+        });
+    """)
+
+    blocks = None
+    if extraction_mode == 'script':
+        blocks = extract_schedule_blocks_by_script(driver)
+    if blocks is None:
+        blocks = extract_schedule_blocks_by_element(driver)
+    return blocks
+
+def extract_schedule_blocks_by_script(driver):
+    """
+    表示中の月の全スケジュールブロックをexecute_script1回で取得
+    失敗した場合はNoneを返し、要素ごとの取得にフォールバックさせる
+    """
+    try:
+        blocks = driver.execute_script(SCHEDULE_BLOCKS_SCRIPT)
+    except WebDriverException as e:
+        print(f"スクリプトでの取得に失敗したため要素ごとに取得します: {e}")
+        return None
+    if not isinstance(blocks, list):
+        return None
+    return blocks
+
+def extract_schedule_blocks_by_element(driver):
+    """
+    表示中の月のスケジュールブロックを要素ごとに取得
+    """
+    blocks = []
+    for block in driver.find_elements(By.CSS_SELECTOR, '.schedule-block'):
+        schedule_times = block.find_elements(By.CSS_SELECTOR, '.schedule-time')
+        schedule_details = block.find_elements(By.CSS_SELECTOR, '.schedule-detail')
+
+        entries = []
+        for time_block, detail_block in zip(schedule_times, schedule_details):
+            entries.append({
+                'title': get_element_text(time_block, 'strong'),
+                'times': get_element_text(time_block, 'span'),
+                'members': get_members_text(detail_block),
+                'detail': get_element_text(detail_block, 'dl:nth-of-type(3) dd'),
+                'link': get_element_attribute(detail_block, '.btns a:not(.is-pink)', 'href')
+            })
+        blocks.append({'id': block.get_attribute('id'), 'entries': entries})
+    return blocks
+
+def build_schedule_records(venue_name, blocks):
+    """
+    取得したスケジュールブロックをCSVのレコード形式に変換
+    """
+    events = []
+    for block in blocks:
+        date = block['id'].replace('schedule', '')
+        for entry in block['entries']:
+            title = entry['title']
+            # 除外公演
+            if any(keyword in title for keyword in ['休館日', '貸切']):
+                continue
+
+            times = entry['times'].split('｜')
+            open_time, start_time, end_time = parse_times(times)
+            members = format_members(entry['members'])
+            detail = clean_text(entry['detail'])
+
+            events.append({
+                'Venue': venue_name,
+                'Title': title,
+                'Date': date,
+                'OpenTime': open_time,
+                'StartTime': start_time,
+                'EndTime': end_time,
+                'Members': members,
+                'Detail': detail,
+                'Link': entry['link']
+            })
     return events
 
+def get_schedule_signature(driver):
+    try:
+        return driver.execute_script(SCHEDULE_SIGNATURE_SCRIPT)
+    except WebDriverException:
+        return None
+
+def is_displayed(driver, link, month=None):
+    """
+    クリックしようとしている月・ステージが既に表示中か
+    リンクが表示中の状態であるか、month（(年, 月)）を指定した場合は
+    スケジュールブロックのIDがすべてその月であれば表示中とみなす
+    """
+    try:
+        if driver.execute_script(ACTIVE_LINK_SCRIPT, link):
+            return True
+        if month is None:
+            return False
+        block_ids = driver.execute_script(SCHEDULE_IDS_SCRIPT) or []
+    except WebDriverException:
+        return False
+    months = set()
+    for block_id in block_ids:
+        match = re.search(r'(\d{4})-?(\d{2})', block_id or '')
+        if match is None:
+            return False
+        months.add((int(match.group(1)), int(match.group(2))))
+    return months == {tuple(month)}
+
+def wait_for_schedule_change(driver, previous_signature, kind, label):
+    """
+    クリック後、スケジュール部分のDOMが書き換わり、描画が落ち着くまで待機
+    書き換え途中の空の状態や描画途中の状態を取得しないよう、
+    前回と異なる空でない署名が2回続けて同じになった時点で完了とする
+    """
+    polled = {'signature': None}
+
+    def settled(d):
+        signature = get_schedule_signature(d)
+        stable = signature == polled['signature']
+        polled['signature'] = signature
+        return (stable and signature != previous_signature
+                and signature is not None and not signature.startswith('0|'))
+
+    return wait_until(driver, settled, kind, label)
+
+def wait_until(driver, condition, kind, label):
+    """
+    条件を満たすまで最大wait_timeout秒待機し、実際に待った時間を記録
+    """
+    start = t.monotonic()
+    try:
+        WebDriverWait(driver, wait_timeout, poll_frequency=0.1).until(condition)
+        ready = True
+    except TimeoutException:
+        ready = False
+    wait_timings.append({
+        'kind': kind,
+        'label': label,
+        'seconds': t.monotonic() - start,
+        'ready': ready
+    })
+    return ready
+
+def report_wait_timings():
+    """
+    待機時間の内訳を種類ごとに出力
+    """
+    for kind in ['page', 'stage', 'month']:
+        timings = [timing for timing in wait_timings if timing['kind'] == kind]
+        if not timings:
+            continue
+        total = sum(timing['seconds'] for timing in timings)
+        timeouts = sum(1 for timing in timings if not timing['ready'])
+        slowest = max(timings, key=lambda timing: timing['seconds'])
+        print(f"wait[{kind}]: {len(timings)}回 合計{total:.2f}秒 "
+              f"タイムアウト{timeouts}回 最長{slowest['seconds']:.2f}秒 ({slowest['label']})")
+
 def convert_venue_name(venue_name):
     """
     Venueの表記ゆれを変換
@@ -110,16 +387,6 @@ def convert_venue_name(venue_name):
     }
     return conversions.get(venue_name, venue_name)
 
-def setup_driver_options():
-    options = Options()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    # User-Agentの設定
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.6723.92 Safari/537.36"
-    options.add_argument(f"user-agent={user_agent}")
-    return options
-
 def get_element_text(element, selector):
     try:
         return element.find_element(By.CSS_SELECTOR, selector).text or '-'
@@ -132,13 +399,20 @@ def get_element_attribute(element, selector, attribute):
     except:
         return '-'
 
-def get_members(detail_block):
+def get_members_text(detail_block):
     try:
         members_element = detail_block.find_element(By.CSS_SELECTOR, 'dd.schedule-detail-member')
-        all_text = members_element.get_attribute('innerText')
-        return all_text.replace('\n', '／') or '-'
+        return members_element.get_attribute('innerText')
     except:
+        return None
+
+def format_members(all_text):
+    """
+    出演者の改行を区切り文字に変換
+    """
+    if all_text is None:
         return '-'
+    return all_text.replace('\n', '／') or '-'
 
 def parse_times(times):
     try:
@@ -155,14 +429,90 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-all_events = []
-for venue in theaters:
-    stages = venue.get('stages')
-    events = get_schedule_info(venue['name'], venue['url'], stages)
-    all_events.extend(events)
+def iter_theater_events(theaters, cache, month_window, skip=None):
+    """
+    劇場ごとに (劇場名, レコードの一覧) を設定順に返す
+    skip(劇場名) が真を返す劇場は取得しない
+    ブラウザプールが2以上なら劇場・ステージ単位で並列に取得する
+    """
+    theaters = [venue for venue in theaters if not (skip and skip(venue['name']))]
+    pool = BrowserPool()
+    if pool.size <= 1:
+        yield from iter_theater_events_serial(theaters, cache, month_window)
+        return
+    with pool:
+        yield from iter_theater_events_parallel(theaters, cache, month_window, pool)
+
+def iter_theater_events_serial(theaters, cache, month_window):
+    # 全劇場で1つのブラウザを使い回す（ブラウザは必要になった時点で起動）
+    with BrowserSession() as session, HttpClient() as client:
+        for venue in theaters:
+            stages = venue.get('stages')
+            yield venue['name'], get_schedule_info(session, venue['name'], venue['url'], stages,
+                                                   client if scraper_engine == 'http' else None, cache, month_window)
+
+def iter_theater_events_parallel(theaters, cache, month_window, pool):
+    # ステージのある劇場はステージごとに分割
+    tasks = [
+        (venue['name'], venue['url'], stage)
+        for venue in theaters
+        for stage in (venue.get('stages') or [None])
+    ]
+    host_limits = {urlparse(url).netloc: threading.Semaphore(host_concurrency) for _, url, _ in tasks}
+
+    def run(task, client):
+        venue_name, url, stage = task
+        with host_limits[urlparse(url).netloc], pool.session() as session:
+            return get_schedule_info(session, venue_name, url, [stage] if stage else None,
+                                     client if scraper_engine == 'http' else None, cache, month_window)
+
+    with HttpClient(pool_size=pool.size) as client, ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {}
+        for task in tasks:
+            futures.setdefault(task[0], []).append(executor.submit(run, task, client))
+        # 完了順ではなく設定順に、劇場の全ステージがそろった時点で返す
+        for venue in theaters:
+            yield venue['name'], [event for future in futures[venue['name']] for event in future.result()]
+
+def scrape_theaters(theaters, cache, month_window):
+    """
+    全劇場のスケジュールを取得
+    """
+    return [event for _, events in iter_theater_events(theaters, cache, month_window) for event in events]
+
+def scrape_theater_schedules(theaters, cache=None, checkpoint=True):
+    """
+    全劇場のスケジュールを取得してDataFrameで返す
+    checkpoint が真なら劇場ごとにCSVへ追記し、中断した場合は次回その続きから取得する
+    cache を指定しない場合はここで作成・保存する
+    """
+    own_cache = cache is None
+    cache = cache or PageCache()
+    month_window = MonthWindow()
+    try:
+        if not checkpoint:
+            return pd.DataFrame(scrape_theaters(theaters, cache, month_window))
+
+        with RecordWriter('theater_schedules.csv', THEATER_SCHEMA.names) as writer:
+            for key, events in iter_theater_events(theaters, cache, month_window, writer.is_completed):
+                writer.write(key, events)
+        df = writer.read()
+        write_events_arrow(df, 'theater_schedules.arrow', THEATER_SCHEMA, source='theater_schedules.csv')
+        return df
+    finally:
+        if own_cache:
+            cache.save()
+        month_window.save()
+
+def main():
+    theaters = json.loads(os.getenv('THEATERS'))
+
+    # 劇場ごとにCSVへ保存
+    scrape_theater_schedules(theaters)
+
+    print("公演スケジュールの取得が完了し、CSVファイルに保存しました。")
+    report_wait_timings()
 
-# データをCSVに保存
-df = pd.DataFrame(all_events)
-df.to_csv('theater_schedules.csv', index=False, encoding='utf-8-sig', quoting=csv.QUOTE_ALL)
+if __name__ == "__main__":
+    main()
 
-print("公演スケジュールの取得が完了し、CSVファイルに保存しました。")